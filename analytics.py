@@ -5,152 +5,648 @@ Track API usage, costs, and user activity
 
 import sqlite3
 import os
-from datetime import datetime, timedelta
+import time
+import atexit
+import hashlib
+import logging
+import threading
+from collections import deque
+from functools import lru_cache
+from itertools import chain
+from datetime import datetime, timedelta, timezone
 from typing import Dict, List, Tuple
 import json
 
+logger = logging.getLogger(__name__)
+
+# Columns written by the background writer, keyed by table
+INSERT_COLUMNS = {
+    'api_usage': ('timestamp', 'user_id', 'username', 'api_type', 'feature',
+                  'tokens_used', 'cost', 'success', 'error_message'),
+    'user_activity': ('timestamp', 'user_id', 'username', 'first_name', 'action', 'details'),
+    'downloads': ('timestamp', 'user_id', 'username', 'platform', 'content_type',
+                  'success', 'file_size'),
+}
+
+# Largest multi-row INSERT chunk, also kept under SQLite's
+# historical limit of 999 bound parameters per statement
+MAX_INSERT_CHUNK = 512
+MAX_SQL_VARIABLES = 999
+
+
+# Timestamp index per table as (name, definition); cleanup_old_data
+# drops and recreates these around large bulk deletes
+TIMESTAMP_INDEXES = {
+    'api_usage': ('idx_api_ts_cost', 'api_usage(timestamp, cost)'),
+    'user_activity': ('idx_activity_ts_user', 'user_activity(timestamp, user_id)'),
+    'downloads': ('idx_downloads_ts_success', 'downloads(timestamp, success, platform)'),
+}
+
+# Share of a table that must be expiring before cleanup drops its index
+BULK_DELETE_FRACTION = 0.25
+
+
+@lru_cache(maxsize=None)
+def _insert_sql(table: str, rows: int = 1) -> str:
+    """Build an INSERT statement for `rows` rows of `table`."""
+    columns = INSERT_COLUMNS[table]
+    placeholders = '(' + ', '.join('?' * len(columns)) + ')'
+    return (f"INSERT INTO {table} ({', '.join(columns)}) VALUES "
+            + ', '.join([placeholders] * rows))
+
+
+@lru_cache(maxsize=None)
+def _insert_chunk_size(table: str) -> int:
+    """Largest power-of-two row count that fits in one INSERT for `table`."""
+    limit = min(MAX_INSERT_CHUNK, MAX_SQL_VARIABLES // len(INSERT_COLUMNS[table]))
+    size = 1
+    while size * 2 <= limit:
+        size *= 2
+    return size
+
+
+# Read queries, kept as module constants so every call hits the
+# connection's prepared-statement cache with the same SQL text
+SQL_TOTAL_STATS = '''
+    SELECT
+        (SELECT COUNT(*) FROM user_stats),
+        SUM(total_requests), SUM(total_cost),
+        SUM(total_downloads), SUM(total_tokens)
+    FROM daily_stats
+'''
+
+SQL_TODAY_ROLLUP = '''
+    SELECT total_users, total_requests, total_cost, total_downloads
+    FROM daily_stats
+    WHERE date = ?
+'''
+
+SQL_TOP_USERS = '''
+    SELECT
+        user_id,
+        username,
+        activity_count,
+        last_active
+    FROM user_stats
+    ORDER BY activity_count DESC
+    LIMIT ?
+'''
+
+SQL_FEATURE_USAGE = '''
+    SELECT
+        feature,
+        COUNT(*) as usage_count,
+        SUM(cost) as total_cost,
+        SUM(tokens_used) as total_tokens
+    FROM api_usage
+    GROUP BY feature
+    ORDER BY usage_count DESC
+'''
+
+SQL_PLATFORM_DOWNLOADS = '''
+    SELECT
+        platform,
+        COUNT(*) as download_count,
+        SUM(success = 1) as successful,
+        SUM(success = 0) as failed
+    FROM downloads
+    GROUP BY platform
+    ORDER BY download_count DESC
+'''
+
+SQL_HOURLY_ACTIVITY = '''
+    SELECT
+        strftime('%H', bucket) as hour,
+        SUM(count) as activity_count
+    FROM hourly_activity
+    WHERE bucket >= ?
+    GROUP BY hour
+    ORDER BY hour
+'''
+
+SQL_COST_BREAKDOWN = '''
+    SELECT
+        api_type,
+        feature,
+        COUNT(*) as calls,
+        SUM(cost) as total_cost,
+        AVG(cost) as avg_cost
+    FROM api_usage
+    WHERE cost > 0
+    GROUP BY api_type, feature
+    ORDER BY total_cost DESC
+'''
+
+SQL_ERROR_STATS = '''
+    SELECT
+        feature,
+        COUNT(*) as error_count,
+        error_message
+    FROM api_usage
+    WHERE success=0 AND error_message IS NOT NULL
+    GROUP BY feature, error_message
+    ORDER BY error_count DESC
+    LIMIT 20
+'''
+
+SQL_RECENT_ACTIVITY = '''
+    SELECT
+        timestamp,
+        username,
+        first_name,
+        action,
+        details
+    FROM user_activity
+    ORDER BY timestamp DESC
+    LIMIT ?
+'''
+
+SQL_DOWNLOADED_BYTES = '''
+    SELECT SUM(file_size) FROM downloads WHERE success = 1
+'''
+
+SQL_RECENT_DOWNLOADS = '''
+    SELECT
+        strftime('%H:%M:%S', timestamp) as time,
+        username,
+        platform,
+        content_type,
+        success,
+        ROUND(file_size / 1024.0 / 1024.0, 2) as size_mb
+    FROM downloads
+    ORDER BY timestamp DESC
+    LIMIT ?
+'''
+
+SQL_RECENT_API_USAGE = '''
+    SELECT
+        strftime('%H:%M:%S', timestamp) as time,
+        username,
+        feature,
+        tokens_used,
+        cost,
+        success
+    FROM api_usage
+    ORDER BY timestamp DESC
+    LIMIT ?
+'''
+
+SQL_WEEK_COST = '''
+    SELECT SUM(cost) FROM api_usage
+    WHERE timestamp >= ?
+'''
+
+
+def _utc_timestamp(days_ago: int = 0) -> str:
+    """UTC time `days_ago` days back, in the format of SQLite's CURRENT_TIMESTAMP."""
+    moment = datetime.now(timezone.utc) - timedelta(days=days_ago)
+    return moment.strftime('%Y-%m-%d %H:%M:%S')
+
+
+class QueryCache:
+    """In-memory TTL cache for query results, keyed by an MD5 of SQL + params."""
+
+    def __init__(self, ttl: float = 60.0):
+        self.ttl = ttl
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(sql: str, params: tuple = ()) -> str:
+        """Build a cache key for a query and its parameters."""
+        return hashlib.md5(f"{sql}|{params!r}".encode()).hexdigest()
+
+    def get(self, key: str):
+        """Return the cached value, or None if missing or expired."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if time.monotonic() >= expires_at:
+                del self._entries[key]
+                return None
+            return value
+
+    def set(self, key: str, value):
+        """Cache a value for `ttl` seconds."""
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+
+    def clear(self):
+        """Drop every cached value."""
+        with self._lock:
+            self._entries.clear()
+
+
 class Analytics:
     """Track and analyze bot usage."""
 
+    # Queued log rows are written every FLUSH_INTERVAL seconds,
+    # or sooner once a table has FLUSH_BATCH_SIZE rows waiting
+    FLUSH_INTERVAL = 0.5
+    FLUSH_BATCH_SIZE = 100
+
+    # Seconds between PRAGMA optimize runs from the writer thread
+    OPTIMIZE_INTERVAL = 3600
+
     def __init__(self, db_path: str = "analytics.db"):
         self.db_path = db_path
+
+        # One long-lived connection shared by every call (autocommit mode),
+        # with room in the statement cache for every query in this module
+        self._conn = sqlite3.connect(db_path, check_same_thread=False,
+                                     isolation_level=None, cached_statements=256)
+        self._lock = threading.RLock()
+        self.query_cache = QueryCache()
+
+        # WAL + relaxed fsync suit this write-heavy logging workload.
+        # All of these are safe to re-apply on an existing database.
+        self._conn.executescript('''
+            PRAGMA journal_mode=WAL;
+            PRAGMA synchronous=NORMAL;
+            PRAGMA temp_store=MEMORY;
+            PRAGMA cache_size=-64000;
+            PRAGMA mmap_size=268435456;
+            PRAGMA busy_timeout=5000;
+        ''')
+
         self.init_database()
 
+        # Log rows are buffered here and written in batches by _flush_loop
+        self._queues = {table: deque() for table in INSERT_COLUMNS}
+        self._flush_event = threading.Event()
+        self._closed = False
+        self._flush_thread = threading.Thread(target=self._flush_loop, daemon=True)
+        self._flush_thread.start()
+        atexit.register(self._at_exit)
+
+    def close(self):
+        """Flush pending rows and close the shared database connection."""
+        self._closed = True
+        self._flush_event.set()
+        self._flush_thread.join()
+        atexit.unregister(self._at_exit)
+
+        with self._lock:
+            self._at_exit()
+            self._conn.close()
+
+    def _at_exit(self):
+        """Write pending rows and refresh planner statistics."""
+        self.flush()
+        self.optimize()
+
+    def optimize(self):
+        """Run PRAGMA optimize (only re-analyzes tables that need it)."""
+        with self._lock:
+            self._conn.execute('PRAGMA optimize')
+
+    def _enqueue(self, table: str, row: tuple):
+        """Queue a row for the background writer (never touches SQLite)."""
+        queue = self._queues[table]
+        queue.append(row)
+        if len(queue) >= self.FLUSH_BATCH_SIZE:
+            self._flush_event.set()
+
+    def _flush_loop(self):
+        """Background thread that periodically writes queued rows."""
+        last_optimize = time.monotonic()
+
+        while not self._closed:
+            self._flush_event.wait(self.FLUSH_INTERVAL)
+            self._flush_event.clear()
+            try:
+                self.flush()
+
+                if time.monotonic() - last_optimize >= self.OPTIMIZE_INTERVAL:
+                    self.optimize()
+                    last_optimize = time.monotonic()
+            except sqlite3.Error as e:
+                logger.error("Analytics flush error: %s", e)
+
+    def flush(self):
+        """Write all queued log rows in a single transaction."""
+        with self._lock:
+            batches = []
+            for table, queue in self._queues.items():
+                rows = [queue.popleft() for _ in range(len(queue))]
+                if rows:
+                    batches.append((table, rows))
+
+            if not batches:
+                return
+
+            self._conn.execute('BEGIN')
+            try:
+                for table, rows in batches:
+                    self._insert_rows(table, rows)
+                self._conn.execute('COMMIT')
+            except sqlite3.Error:
+                self._conn.execute('ROLLBACK')
+                # Put the rows back (ahead of newer ones) for the next flush
+                for table, rows in batches:
+                    self._queues[table].extendleft(reversed(rows))
+                raise
+
+    def _insert_rows(self, table: str, rows: List[tuple]):
+        """Insert rows using multi-row VALUES chunks, executemany for the tail."""
+        chunk = _insert_chunk_size(table)
+        full = len(rows) - len(rows) % chunk
+
+        if full:
+            sql = _insert_sql(table, chunk)
+            for start in range(0, full, chunk):
+                params = tuple(chain.from_iterable(rows[start:start + chunk]))
+                self._conn.execute(sql, params)
+
+        if full < len(rows):
+            self._conn.executemany(_insert_sql(table), rows[full:])
+
     def init_database(self):
         """Initialize SQLite database with required tables."""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-
-        # API Usage table
+        with self._lock:
+            cursor = self._conn.cursor()
+
+            # API Usage table
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS api_usage (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+                    user_id INTEGER,
+                    username TEXT,
+                    api_type TEXT,
+                    feature TEXT,
+                    tokens_used INTEGER DEFAULT 0,
+                    cost REAL DEFAULT 0.0,
+                    success BOOLEAN DEFAULT 1,
+                    error_message TEXT
+                )
+            ''')
+
+            # User Activity table
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS user_activity (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+                    user_id INTEGER,
+                    username TEXT,
+                    first_name TEXT,
+                    action TEXT,
+                    details TEXT
+                )
+            ''')
+
+            # Download Stats table
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS downloads (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+                    user_id INTEGER,
+                    username TEXT,
+                    platform TEXT,
+                    content_type TEXT,
+                    success BOOLEAN DEFAULT 1,
+                    file_size INTEGER DEFAULT 0
+                )
+            ''')
+
+            # Daily Stats summary table
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS daily_stats (
+                    date DATE PRIMARY KEY,
+                    total_users INTEGER DEFAULT 0,
+                    total_requests INTEGER DEFAULT 0,
+                    total_downloads INTEGER DEFAULT 0,
+                    total_captions INTEGER DEFAULT 0,
+                    total_cost REAL DEFAULT 0.0,
+                    total_tokens INTEGER DEFAULT 0
+                )
+            ''')
+
+            # Users seen per day, so the daily_stats trigger can count
+            # distinct users with a primary-key insert instead of a scan
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS daily_users (
+                    date DATE,
+                    user_id INTEGER,
+                    PRIMARY KEY (date, user_id)
+                ) WITHOUT ROWID
+            ''')
+
+            # Hourly activity summary table (one row per hour bucket)
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS hourly_activity (
+                    bucket DATETIME PRIMARY KEY,
+                    count INTEGER DEFAULT 0
+                )
+            ''')
+
+            # Per-user summary table (one row per user)
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS user_stats (
+                    user_id INTEGER PRIMARY KEY,
+                    username TEXT,
+                    activity_count INTEGER DEFAULT 0,
+                    last_active DATETIME
+                )
+            ''')
+
+            # Older databases were created without total_tokens
+            cursor.execute('PRAGMA table_info(daily_stats)')
+            if 'total_tokens' not in [row[1] for row in cursor.fetchall()]:
+                cursor.execute('ALTER TABLE daily_stats ADD COLUMN total_tokens INTEGER DEFAULT 0')
+
+            # Indices matching the dashboard's filters and groupings
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_api_feature ON api_usage(feature, success)')
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_user_stats_count ON user_stats(activity_count DESC)')
+            # Covers SUM(file_size) over successful downloads without touching the table
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_downloads_success_size ON downloads(success, file_size)')
+            for name, definition in TIMESTAMP_INDEXES.values():
+                cursor.execute(f'CREATE INDEX IF NOT EXISTS {name} ON {definition}')
+            # Superseded by idx_api_ts_cost, which also covers the week's cost sum
+            cursor.execute('DROP INDEX IF EXISTS idx_api_ts')
+
+            # Keep the rollup tables up to date as rows are inserted. If
+            # their triggers are new, backfill them from existing rows.
+            cursor.execute("SELECT name FROM sqlite_master WHERE type = 'trigger'")
+            triggers = {row[0] for row in cursor.fetchall()}
+            has_daily_triggers = {'trg_api_usage_daily_stats', 'trg_user_activity_daily_users',
+                                  'trg_downloads_daily_stats'} <= triggers
+            has_hourly_trigger = 'trg_user_activity_hourly_activity' in triggers
+            has_user_trigger = 'trg_user_activity_user_stats' in triggers
+
+            # Replaced by trg_user_activity_daily_users; its NOT EXISTS check
+            # scanned the whole day's activity on every insert
+            cursor.execute('DROP TRIGGER IF EXISTS trg_user_activity_daily_stats')
+
+            cursor.executescript('''
+                CREATE TRIGGER IF NOT EXISTS trg_api_usage_daily_stats
+                AFTER INSERT ON api_usage
+                BEGIN
+                    INSERT INTO daily_stats (date, total_requests, total_captions, total_cost, total_tokens)
+                    VALUES (DATE(NEW.timestamp), 1, COALESCE(NEW.feature = 'caption', 0),
+                            COALESCE(NEW.cost, 0), COALESCE(NEW.tokens_used, 0))
+                    ON CONFLICT(date) DO UPDATE SET
+                        total_requests = total_requests + 1,
+                        total_captions = total_captions + excluded.total_captions,
+                        total_cost = total_cost + excluded.total_cost,
+                        total_tokens = total_tokens + excluded.total_tokens;
+                END;
+
+                CREATE TRIGGER IF NOT EXISTS trg_user_activity_daily_users
+                AFTER INSERT ON user_activity
+                BEGIN
+                    INSERT OR IGNORE INTO daily_users (date, user_id)
+                    VALUES (DATE(NEW.timestamp), NEW.user_id);
+                    -- changes() is 1 only for the user's first activity that day
+                    INSERT INTO daily_stats (date, total_users)
+                    VALUES (DATE(NEW.timestamp), changes())
+                    ON CONFLICT(date) DO UPDATE SET
+                        total_users = total_users + excluded.total_users;
+                END;
+
+                CREATE TRIGGER IF NOT EXISTS trg_downloads_daily_stats
+                AFTER INSERT ON downloads
+                BEGIN
+                    INSERT INTO daily_stats (date, total_downloads)
+                    VALUES (DATE(NEW.timestamp), COALESCE(NEW.success = 1, 0))
+                    ON CONFLICT(date) DO UPDATE SET
+                        total_downloads = total_downloads + excluded.total_downloads;
+                END;
+
+                CREATE TRIGGER IF NOT EXISTS trg_user_activity_hourly_activity
+                AFTER INSERT ON user_activity
+                BEGIN
+                    INSERT INTO hourly_activity (bucket, count)
+                    VALUES (strftime('%Y-%m-%d %H:00:00', NEW.timestamp), 1)
+                    ON CONFLICT(bucket) DO UPDATE SET count = count + 1;
+                END;
+
+                CREATE TRIGGER IF NOT EXISTS trg_user_activity_user_stats
+                AFTER INSERT ON user_activity
+                BEGIN
+                    INSERT INTO user_stats (user_id, username, activity_count, last_active)
+                    VALUES (NEW.user_id, NEW.username, 1, NEW.timestamp)
+                    ON CONFLICT(user_id) DO UPDATE SET
+                        username = excluded.username,
+                        activity_count = activity_count + 1,
+                        last_active = MAX(last_active, excluded.last_active);
+                END;
+            ''')
+
+            if not has_daily_triggers:
+                self._rebuild_daily_stats(cursor)
+            if not has_hourly_trigger:
+                self._rebuild_hourly_activity(cursor)
+            if not has_user_trigger:
+                self._rebuild_user_stats(cursor)
+
+            # Give the planner index statistics the first time round;
+            # PRAGMA optimize keeps them fresh afterwards
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE name = 'sqlite_stat1'")
+            if cursor.fetchone() is None:
+                cursor.execute('ANALYZE')
+
+    def _rebuild_daily_stats(self, cursor):
+        """Recompute every daily_stats row (and daily_users) from the raw tables."""
+        cursor.execute('DELETE FROM daily_users')
         cursor.execute('''
-            CREATE TABLE IF NOT EXISTS api_usage (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-                user_id INTEGER,
-                username TEXT,
-                api_type TEXT,
-                feature TEXT,
-                tokens_used INTEGER DEFAULT 0,
-                cost REAL DEFAULT 0.0,
-                success BOOLEAN DEFAULT 1,
-                error_message TEXT
-            )
+            INSERT INTO daily_users (date, user_id)
+            SELECT DISTINCT DATE(timestamp), user_id FROM user_activity
         ''')
 
-        # User Activity table
+        cursor.execute('DELETE FROM daily_stats')
         cursor.execute('''
-            CREATE TABLE IF NOT EXISTS user_activity (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-                user_id INTEGER,
-                username TEXT,
-                first_name TEXT,
-                action TEXT,
-                details TEXT
+            INSERT INTO daily_stats
+            (date, total_users, total_requests, total_downloads, total_captions, total_cost, total_tokens)
+            SELECT date, SUM(users), SUM(requests), SUM(downloads), SUM(captions), SUM(cost), SUM(tokens)
+            FROM (
+                SELECT date, COUNT(*) AS users,
+                       0 AS requests, 0 AS downloads, 0 AS captions, 0 AS cost, 0 AS tokens
+                FROM daily_users GROUP BY 1
+                UNION ALL
+                SELECT DATE(timestamp), 0, COUNT(*), 0, COALESCE(SUM(feature = 'caption'), 0),
+                       COALESCE(SUM(cost), 0), COALESCE(SUM(tokens_used), 0)
+                FROM api_usage GROUP BY 1
+                UNION ALL
+                SELECT DATE(timestamp), 0, 0, COALESCE(SUM(success = 1), 0), 0, 0, 0
+                FROM downloads GROUP BY 1
             )
+            GROUP BY date
         ''')
 
-        # Download Stats table
+    def _rebuild_hourly_activity(self, cursor):
+        """Recompute every hourly_activity bucket from user_activity."""
+        cursor.execute('DELETE FROM hourly_activity')
         cursor.execute('''
-            CREATE TABLE IF NOT EXISTS downloads (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-                user_id INTEGER,
-                username TEXT,
-                platform TEXT,
-                content_type TEXT,
-                success BOOLEAN DEFAULT 1,
-                file_size INTEGER DEFAULT 0
-            )
+            INSERT INTO hourly_activity (bucket, count)
+            SELECT strftime('%Y-%m-%d %H:00:00', timestamp), COUNT(*)
+            FROM user_activity
+            GROUP BY 1
         ''')
 
-        # Daily Stats summary table
+    def _rebuild_user_stats(self, cursor):
+        """Recompute every user_stats row from user_activity."""
+        cursor.execute('DELETE FROM user_stats')
         cursor.execute('''
-            CREATE TABLE IF NOT EXISTS daily_stats (
-                date DATE PRIMARY KEY,
-                total_users INTEGER DEFAULT 0,
-                total_requests INTEGER DEFAULT 0,
-                total_downloads INTEGER DEFAULT 0,
-                total_captions INTEGER DEFAULT 0,
-                total_cost REAL DEFAULT 0.0
-            )
+            INSERT INTO user_stats (user_id, username, activity_count, last_active)
+            SELECT user_id, username, COUNT(*), MAX(timestamp)
+            FROM user_activity
+            GROUP BY user_id
         ''')
 
-        conn.commit()
-        conn.close()
+    def rebuild_daily_stats(self):
+        """Backfill the daily_stats rollup from the raw tables in one pass."""
+        with self._lock:
+            self.flush()
+            cursor = self._conn.cursor()
+
+            cursor.execute('BEGIN')
+            try:
+                self._rebuild_daily_stats(cursor)
+                cursor.execute('COMMIT')
+            except sqlite3.Error:
+                cursor.execute('ROLLBACK')
+                raise
+
+        self.query_cache.clear()
 
     def log_api_usage(self, user_id: int, username: str, api_type: str,
                       feature: str, tokens: int = 0, cost: float = 0.0,
                       success: bool = True, error: str = None):
-        """Log API usage."""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-
-        cursor.execute('''
-            INSERT INTO api_usage
-            (user_id, username, api_type, feature, tokens_used, cost, success, error_message)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (user_id, username, api_type, feature, tokens, cost, success, error))
-
-        conn.commit()
-        conn.close()
+        """Log API usage (non-blocking; safe to call from the event loop)."""
+        self._enqueue('api_usage', (_utc_timestamp(), user_id, username, api_type,
+                                    feature, tokens, cost, success, error))
 
     def log_user_activity(self, user_id: int, username: str, first_name: str,
                           action: str, details: str = None):
-        """Log user activity."""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-
-        cursor.execute('''
-            INSERT INTO user_activity
-            (user_id, username, first_name, action, details)
-            VALUES (?, ?, ?, ?, ?)
-        ''', (user_id, username, first_name, action, details))
-
-        conn.commit()
-        conn.close()
+        """Log user activity (non-blocking; safe to call from the event loop)."""
+        self._enqueue('user_activity', (_utc_timestamp(), user_id, username,
+                                        first_name, action, details))
 
     def log_download(self, user_id: int, username: str, platform: str,
                      content_type: str, success: bool = True, file_size: int = 0):
-        """Log download activity."""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-
-        cursor.execute('''
-            INSERT INTO downloads
-            (user_id, username, platform, content_type, success, file_size)
-            VALUES (?, ?, ?, ?, ?, ?)
-        ''', (user_id, username, platform, content_type, success, file_size))
-
-        conn.commit()
-        conn.close()
+        """Log download activity (non-blocking; safe to call from the event loop)."""
+        self._enqueue('downloads', (_utc_timestamp(), user_id, username,
+                                    platform, content_type, success, file_size))
 
     def get_total_stats(self) -> Dict:
         """Get total statistics."""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-
-        # Total users
-        cursor.execute('SELECT COUNT(DISTINCT user_id) FROM user_activity')
-        total_users = cursor.fetchone()[0]
-
-        # Total API calls
-        cursor.execute('SELECT COUNT(*) FROM api_usage')
-        total_api_calls = cursor.fetchone()[0]
-
-        # Total cost
-        cursor.execute('SELECT SUM(cost) FROM api_usage')
-        total_cost = cursor.fetchone()[0] or 0.0
-
-        # Total downloads
-        cursor.execute('SELECT COUNT(*) FROM downloads WHERE success=1')
-        total_downloads = cursor.fetchone()[0]
-
-        # Total tokens
-        cursor.execute('SELECT SUM(tokens_used) FROM api_usage')
-        total_tokens = cursor.fetchone()[0] or 0
-
-        conn.close()
+        with self._lock:
+            self.flush()
+            cursor = self._conn.cursor()
+
+            # API calls, cost, downloads and tokens come from the daily
+            # rollup; distinct users can't be summed across days, so they
+            # are the row count of user_stats (one row per user, kept up
+            # to date by a trigger on user_activity)
+            cursor.execute(SQL_TOTAL_STATS)
+            total_users, total_api_calls, total_cost, total_downloads, total_tokens = cursor.fetchone()
+            total_api_calls = total_api_calls or 0
+            total_cost = total_cost or 0.0
+            total_downloads = total_downloads or 0
+            total_tokens = total_tokens or 0
 
         return {
             'total_users': total_users,
@@ -162,40 +658,15 @@ class Analytics:
 
     def get_today_stats(self) -> Dict:
         """Get today's statistics."""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        with self._lock:
+            self.flush()
+            cursor = self._conn.cursor()
 
-        today = datetime.now().date()
+            today = datetime.now().date()
 
-        # Today's users
-        cursor.execute('''
-            SELECT COUNT(DISTINCT user_id) FROM user_activity
-            WHERE DATE(timestamp) = ?
-        ''', (today,))
-        today_users = cursor.fetchone()[0]
-
-        # Today's API calls
-        cursor.execute('''
-            SELECT COUNT(*) FROM api_usage
-            WHERE DATE(timestamp) = ?
-        ''', (today,))
-        today_api_calls = cursor.fetchone()[0]
-
-        # Today's cost
-        cursor.execute('''
-            SELECT SUM(cost) FROM api_usage
-            WHERE DATE(timestamp) = ?
-        ''', (today,))
-        today_cost = cursor.fetchone()[0] or 0.0
-
-        # Today's downloads
-        cursor.execute('''
-            SELECT COUNT(*) FROM downloads
-            WHERE DATE(timestamp) = ? AND success=1
-        ''', (today,))
-        today_downloads = cursor.fetchone()[0]
-
-        conn.close()
+            cursor.execute(SQL_TODAY_ROLLUP, (today.isoformat(),))
+            row = cursor.fetchone() or (0, 0, 0.0, 0)
+            today_users, today_api_calls, today_cost, today_downloads = row
 
         return {
             'today_users': today_users,
@@ -206,108 +677,68 @@ class Analytics:
 
     def get_top_users(self, limit: int = 10) -> List[Tuple]:
         """Get most active users."""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        with self._lock:
+            self.flush()
+            cursor = self._conn.cursor()
 
-        cursor.execute('''
-            SELECT
-                user_id,
-                username,
-                COUNT(*) as activity_count,
-                MAX(timestamp) as last_active
-            FROM user_activity
-            GROUP BY user_id
-            ORDER BY activity_count DESC
-            LIMIT ?
-        ''', (limit,))
+            cursor.execute(SQL_TOP_USERS, (limit,))
 
-        results = cursor.fetchall()
-        conn.close()
+            results = cursor.fetchall()
 
         return results
 
     def get_feature_usage(self) -> List[Tuple]:
         """Get feature usage statistics."""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        with self._lock:
+            self.flush()
+            cursor = self._conn.cursor()
 
-        cursor.execute('''
-            SELECT
-                feature,
-                COUNT(*) as usage_count,
-                SUM(cost) as total_cost,
-                SUM(tokens_used) as total_tokens
-            FROM api_usage
-            GROUP BY feature
-            ORDER BY usage_count DESC
-        ''')
+            cursor.execute(SQL_FEATURE_USAGE)
 
-        results = cursor.fetchall()
-        conn.close()
+            results = cursor.fetchall()
 
         return results
 
     def get_platform_downloads(self) -> List[Tuple]:
         """Get download statistics by platform."""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        with self._lock:
+            self.flush()
+            cursor = self._conn.cursor()
 
-        cursor.execute('''
-            SELECT
-                platform,
-                COUNT(*) as download_count,
-                SUM(CASE WHEN success=1 THEN 1 ELSE 0 END) as successful,
-                SUM(CASE WHEN success=0 THEN 1 ELSE 0 END) as failed
-            FROM downloads
-            GROUP BY platform
-            ORDER BY download_count DESC
-        ''')
+            cursor.execute(SQL_PLATFORM_DOWNLOADS)
 
-        results = cursor.fetchall()
-        conn.close()
+            results = cursor.fetchall()
 
         return results
 
     def get_hourly_activity(self, days: int = 7) -> List[Tuple]:
         """Get hourly activity for last N days."""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        with self._lock:
+            self.flush()
+            cursor = self._conn.cursor()
 
-        cursor.execute('''
-            SELECT
-                strftime('%H', timestamp) as hour,
-                COUNT(*) as activity_count
-            FROM user_activity
-            WHERE timestamp >= datetime('now', '-' || ? || ' days')
-            GROUP BY hour
-            ORDER BY hour
-        ''', (days,))
+            cursor.execute(SQL_HOURLY_ACTIVITY, (_utc_timestamp(days_ago=days),))
 
-        results = cursor.fetchall()
-        conn.close()
+            results = cursor.fetchall()
 
         return results
 
-    def get_cost_breakdown(self) -> Dict:
-        """Get cost breakdown by feature."""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+    def get_cost_breakdown_flat(self) -> Tuple[List[Tuple], Tuple[str, ...]]:
+        """Get cost breakdown rows as returned by SQLite, plus their column names."""
+        with self._lock:
+            self.flush()
+            cursor = self._conn.cursor()
 
-        cursor.execute('''
-            SELECT
-                api_type,
-                feature,
-                COUNT(*) as calls,
-                SUM(cost) as total_cost,
-                AVG(cost) as avg_cost
-            FROM api_usage
-            WHERE cost > 0
-            GROUP BY api_type, feature
-            ORDER BY total_cost DESC
-        ''')
+            cursor.execute(SQL_COST_BREAKDOWN)
 
-        results = cursor.fetchall()
-        conn.close()
+            results = cursor.fetchall()
+            columns = tuple(column[0] for column in cursor.description)
+
+        return results, columns
+
+    def get_cost_breakdown(self) -> Dict:
+        """Get cost breakdown by feature."""
+        results, _ = self.get_cost_breakdown_flat()
 
         breakdown = {}
         for row in results:
@@ -325,81 +756,163 @@ class Analytics:
 
     def get_error_stats(self) -> List[Tuple]:
         """Get error statistics."""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        with self._lock:
+            self.flush()
+            cursor = self._conn.cursor()
 
-        cursor.execute('''
-            SELECT
-                feature,
-                COUNT(*) as error_count,
-                error_message
-            FROM api_usage
-            WHERE success=0 AND error_message IS NOT NULL
-            GROUP BY feature, error_message
-            ORDER BY error_count DESC
-            LIMIT 20
-        ''')
+            cursor.execute(SQL_ERROR_STATS)
 
-        results = cursor.fetchall()
-        conn.close()
+            results = cursor.fetchall()
 
         return results
 
     def get_recent_activity(self, limit: int = 50) -> List[Tuple]:
         """Get recent user activity."""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        with self._lock:
+            self.flush()
+            cursor = self._conn.cursor()
 
-        cursor.execute('''
-            SELECT
-                timestamp,
-                username,
-                first_name,
-                action,
-                details
-            FROM user_activity
-            ORDER BY timestamp DESC
-            LIMIT ?
-        ''', (limit,))
+            cursor.execute(SQL_RECENT_ACTIVITY, (limit,))
 
-        results = cursor.fetchall()
-        conn.close()
+            results = cursor.fetchall()
+
+        return results
+
+    def get_downloaded_bytes(self) -> int:
+        """Get the total size of successful downloads in bytes."""
+        with self._lock:
+            self.flush()
+            cursor = self._conn.cursor()
+
+            cursor.execute(SQL_DOWNLOADED_BYTES)
+
+            total = cursor.fetchone()[0] or 0
+
+        return total
+
+    def get_recent_downloads(self, limit: int = 15) -> List[Tuple]:
+        """Get recent downloads (time of day, size in MB)."""
+        with self._lock:
+            self.flush()
+            cursor = self._conn.cursor()
+
+            cursor.execute(SQL_RECENT_DOWNLOADS, (limit,))
+
+            results = cursor.fetchall()
+
+        return results
+
+    def get_recent_api_usage(self, limit: int = 15) -> List[Tuple]:
+        """Get recent API calls (time of day)."""
+        with self._lock:
+            self.flush()
+            cursor = self._conn.cursor()
+
+            cursor.execute(SQL_RECENT_API_USAGE, (limit,))
+
+            results = cursor.fetchall()
 
         return results
 
     def estimate_monthly_cost(self) -> float:
         """Estimate monthly cost based on recent usage."""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        # The 7-day sum barely moves between calls, so serve it from cache
+        key = QueryCache.make_key(SQL_WEEK_COST)
+        week_cost = self.query_cache.get(key)
 
-        # Get cost for last 7 days
-        cursor.execute('''
-            SELECT SUM(cost) FROM api_usage
-            WHERE timestamp >= datetime('now', '-7 days')
-        ''')
-        week_cost = cursor.fetchone()[0] or 0.0
+        if week_cost is None:
+            with self._lock:
+                self.flush()
+                cursor = self._conn.cursor()
+
+                # Get cost for last 7 days
+                cursor.execute(SQL_WEEK_COST, (_utc_timestamp(days_ago=7),))
+                week_cost = cursor.fetchone()[0] or 0.0
 
-        conn.close()
+            self.query_cache.set(key, week_cost)
 
         # Estimate monthly (assuming 30 days)
         monthly_estimate = (week_cost / 7) * 30
         return round(monthly_estimate, 2)
 
+    def get_dashboard_snapshot(self, top_users: int = 10, recent: int = 20,
+                               hourly_days: int = 7) -> Dict:
+        """Get every dashboard statistic in one locked pass over the connection."""
+        with self._lock:
+            self.flush()
+
+            return {
+                'total_stats': self.get_total_stats(),
+                'today_stats': self.get_today_stats(),
+                'monthly_estimate': self.estimate_monthly_cost(),
+                'cost_breakdown_flat': self.get_cost_breakdown_flat(),
+                'feature_usage': self.get_feature_usage(),
+                'top_users': self.get_top_users(limit=top_users),
+                'recent_activity': self.get_recent_activity(limit=recent),
+                'platform_downloads': self.get_platform_downloads(),
+                'error_stats': self.get_error_stats(),
+                'hourly_activity': self.get_hourly_activity(days=hourly_days),
+            }
+
+    def get_tasks_snapshot(self, limit: int = 15) -> Dict:
+        """Get the recent downloads and API calls in one locked pass."""
+        with self._lock:
+            self.flush()
+
+            return {
+                'recent_downloads': self.get_recent_downloads(limit=limit),
+                'recent_api_usage': self.get_recent_api_usage(limit=limit),
+            }
+
     def cleanup_old_data(self, days: int = 90):
         """Clean up data older than N days."""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-
-        cutoff_date = datetime.now() - timedelta(days=days)
-
-        cursor.execute('DELETE FROM api_usage WHERE timestamp < ?', (cutoff_date,))
-        cursor.execute('DELETE FROM user_activity WHERE timestamp < ?', (cutoff_date,))
-        cursor.execute('DELETE FROM downloads WHERE timestamp < ?', (cutoff_date,))
-
-        conn.commit()
-        deleted = cursor.rowcount
-        conn.close()
-
+        with self._lock:
+            self.flush()
+            cursor = self._conn.cursor()
+
+            deleted = 0
+            cursor.execute('BEGIN')
+            try:
+                # Let SQLite compute the UTC cutoff once, in the stored timestamp format
+                cursor.execute("SELECT datetime('now', ?)", (f'-{days} days',))
+                cutoff_date = cursor.fetchone()[0]
+
+                for table, (index_name, index_definition) in TIMESTAMP_INDEXES.items():
+                    cursor.execute(f'SELECT COUNT(*) FROM {table}')
+                    total = cursor.fetchone()[0]
+                    cursor.execute(f'SELECT COUNT(*) FROM {table} WHERE timestamp < ?', (cutoff_date,))
+                    expired = cursor.fetchone()[0]
+
+                    if not expired:
+                        continue
+
+                    # For big purges, rebuilding the index once is cheaper
+                    # than updating it for every deleted row
+                    bulk = expired >= total * BULK_DELETE_FRACTION
+                    if bulk:
+                        cursor.execute(f'DROP INDEX IF EXISTS {index_name}')
+
+                    cursor.execute(f'DELETE FROM {table} WHERE timestamp < ?', (cutoff_date,))
+                    deleted += cursor.rowcount
+
+                    if bulk:
+                        cursor.execute(f'CREATE INDEX {index_name} ON {index_definition}')
+                cursor.execute('DELETE FROM daily_stats WHERE date < ?', (cutoff_date[:10],))
+                cursor.execute('DELETE FROM daily_users WHERE date < ?', (cutoff_date[:10],))
+                cursor.execute('DELETE FROM hourly_activity WHERE bucket < ?', (cutoff_date,))
+                if deleted:
+                    # Per-user counts can't be trimmed by date, so recount them
+                    self._rebuild_user_stats(cursor)
+                cursor.execute('COMMIT')
+            except sqlite3.Error:
+                cursor.execute('ROLLBACK')
+                raise
+
+            # Reclaim the freed pages (VACUUM can't run inside a transaction)
+            if deleted:
+                cursor.execute('VACUUM')
+
+        self.query_cache.clear()
         return deleted
 
 
@@ -5,7 +5,7 @@ View API usage, costs, and user statistics
 
 import streamlit as st
 import pandas as pd
-from analytics import Analytics
+from analytics import analytics  # one shared instance (connection + writer) per process
 from datetime import datetime
 import plotly.express as px
 import plotly.graph_objects as go
@@ -17,9 +17,6 @@ st.set_page_config(
     layout="wide"
 )
 
-# Initialize analytics
-analytics = Analytics()
-
 # Custom CSS
 st.markdown("""
 <style>
@@ -54,10 +51,20 @@ with st.sidebar:
 
     st.caption("Last updated: " + datetime.now().strftime("%H:%M:%S"))
 
-# Get stats
-total_stats = analytics.get_total_stats()
-today_stats = analytics.get_today_stats()
-monthly_estimate = analytics.estimate_monthly_cost()
+@st.cache_data(ttl=30)
+def load_snapshot():
+    """Dashboard statistics, cached for 30 seconds across reruns."""
+    return analytics.get_dashboard_snapshot(top_users=10, recent=20, hourly_days=7)
+
+if refresh:
+    st.cache_data.clear()
+    analytics.query_cache.clear()
+
+# Get stats (all dashboard queries in one pass)
+snapshot = load_snapshot()
+total_stats = snapshot['total_stats']
+today_stats = snapshot['today_stats']
+monthly_estimate = snapshot['monthly_estimate']
 
 # Overview Section
 st.header("📈 Overview")
@@ -101,32 +108,27 @@ col1, col2 = st.columns(2)
 
 with col1:
     st.subheader("Cost by Feature")
-    cost_breakdown = analytics.get_cost_breakdown()
-
-    if cost_breakdown:
-        cost_data = []
-        for api_type, features in cost_breakdown.items():
-            for feature in features:
-                cost_data.append({
-                    'Feature': f"{api_type} - {feature['feature']}",
-                    'Calls': feature['calls'],
-                    'Total Cost': feature['total_cost'],
-                    'Avg Cost': feature['avg_cost']
-                })
-
-        if cost_data:
-            df = pd.DataFrame(cost_data)
-            st.dataframe(df, use_container_width=True)
-
-            # Pie chart
-            fig = px.pie(df, values='Total Cost', names='Feature', title='Cost Distribution')
-            st.plotly_chart(fig, use_container_width=True)
+    cost_rows, cost_columns = snapshot['cost_breakdown_flat']
+
+    if cost_rows:
+        raw = pd.DataFrame.from_records(cost_rows, columns=cost_columns)
+        df = pd.DataFrame({
+            'Feature': raw['api_type'].astype(str) + ' - ' + raw['feature'].astype(str),
+            'Calls': raw['calls'],
+            'Total Cost': raw['total_cost'].round(4),
+            'Avg Cost': raw['avg_cost'].round(6)
+        })
+        st.dataframe(df, use_container_width=True)
+
+        # Pie chart
+        fig = px.pie(df, values='Total Cost', names='Feature', title='Cost Distribution')
+        st.plotly_chart(fig, use_container_width=True)
     else:
         st.info("No cost data available yet. Start using the bot!")
 
 with col2:
     st.subheader("Feature Usage")
-    feature_usage = analytics.get_feature_usage()
+    feature_usage = snapshot['feature_usage']
 
     if feature_usage:
         df_features = pd.DataFrame(feature_usage, columns=['Feature', 'Usage Count', 'Total Cost', 'Total Tokens'])
@@ -147,7 +149,7 @@ col1, col2 = st.columns(2)
 
 with col1:
     st.subheader("Top Users")
-    top_users = analytics.get_top_users(limit=10)
+    top_users = snapshot['top_users']
 
     if top_users:
         df_users = pd.DataFrame(
@@ -160,7 +162,7 @@ with col1:
 
 with col2:
     st.subheader("Recent Activity")
-    recent = analytics.get_recent_activity(limit=20)
+    recent = snapshot['recent_activity']
 
     if recent:
         df_recent = pd.DataFrame(
@@ -176,7 +178,7 @@ st.divider()
 # Download Statistics
 st.header("📥 Download Statistics")
 
-platform_stats = analytics.get_platform_downloads()
+platform_stats = snapshot['platform_downloads']
 
 if platform_stats:
     df_downloads = pd.DataFrame(
@@ -205,7 +207,7 @@ st.divider()
 # Error Tracking
 st.header("⚠️ Error Statistics")
 
-error_stats = analytics.get_error_stats()
+error_stats = snapshot['error_stats']
 
 if error_stats:
     df_errors = pd.DataFrame(
@@ -221,7 +223,7 @@ st.divider()
 # Hourly Activity
 st.header("🕐 Activity Patterns")
 
-hourly = analytics.get_hourly_activity(days=7)
+hourly = snapshot['hourly_activity']
 
 if hourly:
     df_hourly = pd.DataFrame(hourly, columns=['Hour', 'Activity Count'])
@@ -262,6 +264,7 @@ with col1:
     days = st.number_input("Delete data older than (days):", min_value=30, value=90)
     if st.button("🗑️ Clean Up"):
         deleted = analytics.cleanup_old_data(days)
+        st.cache_data.clear()
         st.success(f"Deleted {deleted} old records!")
         st.rerun()
 
@@ -4,15 +4,22 @@ Supports: Instagram, YouTube, TikTok, Facebook
 """
 
 import os
+import asyncio
+import hashlib
 import logging
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, BotCommand
-from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes, CallbackQueryHandler
+from pathlib import Path
+from time import perf_counter
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, BotCommand, InputFile
+from telegram.error import TelegramError
+from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes, CallbackQueryHandler, AIORateLimiter
 from dotenv import load_dotenv
 
 # Import our custom modules
-from downloaders import ContentDownloader
+from downloaders import ContentDownloader, canonical_url, detect_platform
 from caption_generator import CaptionGenerator
 from analytics import analytics
+from response_cache import response_cache, media_cache, is_error_response
+from bot_tracker import track_user_action, user_info
 
 # Load environment variables
 load_dotenv()
@@ -20,7 +27,8 @@ load_dotenv()
 # Configure logging
 logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO
+    level=logging.INFO,
+    force=True
 )
 logger = logging.getLogger(__name__)
 
@@ -28,22 +36,33 @@ logger = logging.getLogger(__name__)
 downloader = ContentDownloader()
 caption_gen = CaptionGenerator()
 
+# Cap simultaneous downloads so a burst of links doesn't spawn dozens of
+# yt-dlp/ffmpeg jobs at once (CPU, memory and source-site rate limits)
+DOWNLOAD_SEM = asyncio.Semaphore(int(os.getenv('MAX_PARALLEL_DOWNLOADS', '4')))
 
-async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Send welcome message when /start command is issued."""
-    user = update.effective_user
+# Longest side of the photo sent for AI analysis. Telegram already stores
+# several pre-scaled copies, so picking one avoids resizing on our side.
+ANALYSIS_MAX_SIDE = 1280
 
-    # Track user activity
-    analytics.log_user_activity(
-        user_id=user.id,
-        username=user.username or "unknown",
-        first_name=user.first_name or "User",
-        action="start",
-        details="User started the bot"
-    )
+# Telegram limits callback_data to 64 bytes, so buttons carry a short key
+# and the URL itself is kept in bot_data (oldest keys dropped past the cap)
+BUTTON_URLS_MAX = 10000
+
+
+def remember_button_url(context: ContextTypes.DEFAULT_TYPE, url: str) -> str:
+    """Store a URL for inline buttons and return its short callback key."""
+    urls = context.bot_data.setdefault('button_urls', {})
+    key = hashlib.sha256(url.encode()).hexdigest()[:16]
+    urls.pop(key, None)
+    urls[key] = url
+    if len(urls) > BUTTON_URLS_MAX:
+        del urls[next(iter(urls))]
+    return key
 
-    welcome_message = f"""
-👋 Welcome {user.first_name}!
+
+# Static replies, built once at import time
+WELCOME_TEMPLATE = """
+👋 Welcome {name}!
 
 🤖 **Social Media Manager Bot**
 
@@ -66,23 +85,8 @@ I can help you with:
 
 Made with ❤️ for content creators
     """
-    await update.message.reply_text(welcome_message)
-
 
-async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Send help message."""
-    user = update.effective_user
-
-    # Track user activity
-    analytics.log_user_activity(
-        user_id=user.id,
-        username=user.username or "unknown",
-        first_name=user.first_name or "User",
-        action="help",
-        details="User requested help"
-    )
-
-    help_text = """
+HELP_TEXT = """
 📖 **How to Use This Bot:**
 
 **📸 Analyze Your Photos:**
@@ -122,61 +126,130 @@ Example: /hashtags fitness motivation
 
 Need more help? Contact @YourUsername
     """
-    await update.message.reply_text(help_text)
 
+UNSUPPORTED_URL_TEXT = (
+    "❌ I can only download from Instagram, YouTube, TikTok, and Facebook.\n\n"
+    "Send /help to see examples."
+)
+
+
+@track_user_action("start", details="User started the bot")
+async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Send welcome message when /start command is issued."""
+    user = update.effective_user
+
+    await update.message.reply_text(WELCOME_TEMPLATE.format(name=user.first_name))
 
+
+@track_user_action("help", details="User requested help")
+async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Send help message."""
+    await update.message.reply_text(HELP_TEXT)
+
+
+def show_partial(message, header: str):
+    """Return an on_text callback that edits message with the partial AI output."""
+    async def on_text(text: str):
+        try:
+            await message.edit_text(f"{header}\n\n{text}")
+        except TelegramError:
+            pass  # e.g. "message is not modified"; the final text is sent anyway
+    return on_text
+
+
+async def send_media(update: Update, result: dict, media):
+    """Reply with a downloaded video/image; media is an InputFile or a Telegram file_id."""
+    caption = f"✅ Downloaded from {result['platform']}\n\n{result.get('caption', '')}"
+
+    if result['type'] == 'video':
+        return await update.message.reply_video(video=media, caption=caption, supports_streaming=True)
+    elif result['type'] == 'image':
+        return await update.message.reply_photo(photo=media, caption=caption)
+    return None
+
+
+@track_user_action("download", details=lambda update: f"Download requested: {update.message.text.strip()}")
 async def handle_url(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle URLs sent by users."""
     url = update.message.text.strip()
-    user = update.effective_user
+    user_id, username, _ = user_info(update)
 
-    # Track user activity
-    analytics.log_user_activity(
-        user_id=user.id,
-        username=user.username or "unknown",
-        first_name=user.first_name or "User",
-        action="download",
-        details=f"Download requested: {url}"
-    )
-
-    # Check if it's a supported URL
-    if not any(domain in url for domain in ['instagram.com', 'youtube.com', 'youtu.be', 'tiktok.com', 'facebook.com']):
-        await update.message.reply_text(
-            "❌ I can only download from Instagram, YouTube, TikTok, and Facebook.\n\n"
-            "Send /help to see examples."
-        )
+    # Check if it's a supported URL (host lookup, so look-alike domains are rejected)
+    platform = detect_platform(url)
+    if platform is None:
+        await update.message.reply_text(UNSUPPORTED_URL_TEXT)
         return
 
-    # Send processing message
-    processing_msg = await update.message.reply_text("⏳ Processing your link...\nThis may take 30-60 seconds.")
+    # A link sent again within the cache TTL is answered with the Telegram
+    # file_id of the earlier upload: no yt-dlp run and no re-upload
+    # (keyed by the canonical link, so share/tracking variants also hit)
+    media_key = canonical_url(url)
+    cached = await media_cache.get(media_key)
 
-    import time
-    start_time = time.time()
+    # Send processing message (tell the user if they have to wait for a free slot)
+    queued = cached is None and DOWNLOAD_SEM.locked()
+    if queued:
+        processing_msg = await update.message.reply_text("🕒 Your link is queued...\nOther downloads are in progress.")
+    else:
+        processing_msg = await update.message.reply_text("⏳ Processing your link...\nThis may take 30-60 seconds.")
 
+    result = None
     try:
-        # Download the content
-        result = await downloader.download(url)
+        start_time = perf_counter()
+        if cached is None:
+            # Download the content
+            async with DOWNLOAD_SEM:
+                if queued:
+                    await processing_msg.edit_text("⏳ Processing your link...\nThis may take 30-60 seconds.")
+                    start_time = perf_counter()
+                result = await downloader.download(url, platform)
+        else:
+            result = cached
 
         if result['success']:
-            download_time = time.time() - start_time
-            file_size = os.path.getsize(result['file_path']) if os.path.exists(result['file_path']) else 0
+            download_time = perf_counter() - start_time
+
+            if cached is None:
+                media_path = Path(result['file_path'])
+
+                # stat can block on slow storage, so it runs in a worker thread
+                try:
+                    file_size = (await asyncio.to_thread(media_path.stat)).st_size
+                except FileNotFoundError:
+                    file_size = 0
+            else:
+                file_size = result['file_size']
             file_size_mb = file_size / (1024 * 1024)
 
             # Delete processing message
             await processing_msg.delete()
 
             # Send the downloaded content (video/image only with basic caption)
-            if result['type'] == 'video':
-                await update.message.reply_video(
-                    video=open(result['file_path'], 'rb'),
-                    caption=f"✅ Downloaded from {result['platform']}\n\n{result.get('caption', '')}",
-                    supports_streaming=True
-                )
-            elif result['type'] == 'image':
-                await update.message.reply_photo(
-                    photo=open(result['file_path'], 'rb'),
-                    caption=f"✅ Downloaded from {result['platform']}\n\n{result.get('caption', '')}"
-                )
+            if cached is None:
+                # The open file handle is passed straight to the HTTP backend,
+                # which streams it in chunks instead of loading it all into memory.
+                with media_path.open('rb') as media_file:
+                    media = InputFile(media_file, filename=media_path.name, read_file_handle=False)
+                    sent = await send_media(update, result, media)
+
+                # Remember the uploaded file so repeats of this link can reuse it
+                file_id = None
+                if sent is not None and sent.video:
+                    file_id = sent.video.file_id
+                elif sent is not None and sent.photo:
+                    file_id = sent.photo[-1].file_id
+
+                if file_id:
+                    await media_cache.set(media_key, {
+                        'success': True,
+                        'type': result['type'],
+                        'platform': result['platform'],
+                        'caption': result.get('caption', ''),
+                        'file_id': file_id,
+                        'file_size': file_size
+                    })
+            else:
+                await send_media(update, result, result['file_id'])
 
             # Send statistics in separate message
             stats_text = f"""📊 **Download Statistics:**
@@ -189,22 +262,19 @@ async def handle_url(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
             # Track successful download
             analytics.log_download(
-                user_id=user.id,
-                username=user.username or "unknown",
+                user_id=user_id,
+                username=username,
                 platform=result['platform'],
                 content_type=result['type'],
                 success=True,
                 file_size=file_size
             )
 
-            # Clean up downloaded file
-            if os.path.exists(result['file_path']):
-                os.remove(result['file_path'])
-
             # Ask if user wants AI caption
+            url_key = remember_button_url(context, url)
             keyboard = [
-                [InlineKeyboardButton("✨ Generate AI Caption", callback_data=f"caption_{url}")],
-                [InlineKeyboardButton("🔖 Get Hashtags", callback_data=f"hashtags_{url}")]
+                [InlineKeyboardButton("✨ Generate AI Caption", callback_data=f"caption_{url_key}")],
+                [InlineKeyboardButton("🔖 Get Hashtags", callback_data=f"hashtags_{url_key}")]
             ]
             reply_markup = InlineKeyboardMarkup(keyboard)
             await update.message.reply_text(
@@ -214,19 +284,9 @@ async def handle_url(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
         else:
             # Track failed download
-            platform = "Unknown"
-            if 'instagram.com' in url:
-                platform = "Instagram"
-            elif 'youtube.com' in url or 'youtu.be' in url:
-                platform = "YouTube"
-            elif 'tiktok.com' in url:
-                platform = "TikTok"
-            elif 'facebook.com' in url:
-                platform = "Facebook"
-
             analytics.log_download(
-                user_id=user.id,
-                username=user.username or "unknown",
+                user_id=user_id,
+                username=username,
                 platform=platform,
                 content_type="video",
                 success=False
@@ -234,30 +294,27 @@ async def handle_url(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await processing_msg.edit_text(f"❌ Error: {result['error']}")
 
     except Exception as e:
-        logger.error(f"Error downloading: {e}")
+        logger.error("Error downloading: %s", e)
         # Track failed download
         analytics.log_download(
-            user_id=user.id,
-            username=user.username or "unknown",
-            platform="Unknown",
+            user_id=user_id,
+            username=username,
+            platform=platform,
             content_type="video",
             success=False
         )
         await processing_msg.edit_text(f"❌ An error occurred: {str(e)}")
 
+    finally:
+        # Clean up the downloaded file, also when sending it failed
+        if cached is None and result is not None and result['success']:
+            await asyncio.to_thread(downloader.discard, result['file_path'])
 
+
+@track_user_action("caption", details="Caption generation requested")
 async def caption_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Generate AI caption."""
-    user = update.effective_user
-
-    # Track user activity
-    analytics.log_user_activity(
-        user_id=user.id,
-        username=user.username or "unknown",
-        first_name=user.first_name or "User",
-        action="caption",
-        details="Caption generation requested"
-    )
+    user_id, username, _ = user_info(update)
 
     if not context.args:
         await update.message.reply_text(
@@ -269,15 +326,25 @@ async def caption_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     topic = ' '.join(context.args)
     processing_msg = await update.message.reply_text("✍️ Generating caption...")
 
-    import time
-    start_time = time.time()
+    start_time = perf_counter()
 
     try:
-        caption = await caption_gen.generate_caption(topic)
-        generation_time = time.time() - start_time
+        # Reuse a recent caption for the same topic (any word order)
+        cache_key = response_cache.topic_key("caption", topic)
+        caption = await response_cache.get(cache_key)
+        cached = caption is not None
+
+        if not cached:
+            caption = await caption_gen.generate_caption(
+                topic, on_text=show_partial(processing_msg, "✍️ Generating caption...")
+            )
+            if not is_error_response(caption):
+                await response_cache.set(cache_key, caption)
 
-        # Track API usage (estimated)
-        estimated_tokens = 150  # Average tokens for caption
+        generation_time = perf_counter() - start_time
+
+        # Track API usage (estimated; cache hits cost nothing)
+        estimated_tokens = 0 if cached else 150  # Average tokens for caption
         estimated_cost = estimated_tokens * 0.000075 / 1000  # Output token cost
 
         # Send caption first
@@ -295,21 +362,22 @@ async def caption_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
         await update.message.reply_text(stats_text)
 
-        analytics.log_api_usage(
-            user_id=user.id,
-            username=user.username or "unknown",
-            api_type="Gemini AI",
-            feature="caption",
-            tokens=estimated_tokens,
-            cost=estimated_cost,
-            success=True
-        )
+        if not cached:
+            analytics.log_api_usage(
+                user_id=user_id,
+                username=username,
+                api_type="Gemini AI",
+                feature="caption",
+                tokens=estimated_tokens,
+                cost=estimated_cost,
+                success=True
+            )
     except Exception as e:
         await processing_msg.edit_text(f"❌ Error: {str(e)}")
         # Track failed API call
         analytics.log_api_usage(
-            user_id=user.id,
-            username=user.username or "unknown",
+            user_id=user_id,
+            username=username,
             api_type="Gemini AI",
             feature="caption",
             tokens=0,
@@ -319,18 +387,10 @@ async def caption_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
 
 
+@track_user_action("hashtags", details="Hashtag generation requested")
 async def hashtags_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Generate hashtag suggestions."""
-    user = update.effective_user
-
-    # Track user activity
-    analytics.log_user_activity(
-        user_id=user.id,
-        username=user.username or "unknown",
-        first_name=user.first_name or "User",
-        action="hashtags",
-        details="Hashtag generation requested"
-    )
+    user_id, username, _ = user_info(update)
 
     if not context.args:
         await update.message.reply_text(
@@ -343,7 +403,18 @@ async def hashtags_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     processing_msg = await update.message.reply_text("🔖 Generating hashtags...")
 
     try:
-        hashtags = await caption_gen.generate_hashtags(topic)
+        # Reuse recent hashtags for the same topic (any word order)
+        cache_key = response_cache.topic_key("hashtags", topic)
+        hashtags = await response_cache.get(cache_key)
+        if hashtags is not None:
+            await processing_msg.edit_text(f"🔖 **Suggested Hashtags:**\n\n{hashtags}")
+            return
+
+        hashtags = await caption_gen.generate_hashtags(
+            topic, on_text=show_partial(processing_msg, "🔖 Generating hashtags...")
+        )
+        if not is_error_response(hashtags):
+            await response_cache.set(cache_key, hashtags)
         await processing_msg.edit_text(f"🔖 **Suggested Hashtags:**\n\n{hashtags}")
 
         # Track API usage (estimated)
@@ -351,8 +422,8 @@ async def hashtags_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         estimated_cost = estimated_tokens * 0.000075 / 1000  # Output token cost
 
         analytics.log_api_usage(
-            user_id=user.id,
-            username=user.username or "unknown",
+            user_id=user_id,
+            username=username,
             api_type="Gemini AI",
             feature="hashtags",
             tokens=estimated_tokens,
@@ -363,8 +434,8 @@ async def hashtags_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await processing_msg.edit_text(f"❌ Error: {str(e)}")
         # Track failed API call
         analytics.log_api_usage(
-            user_id=user.id,
-            username=user.username or "unknown",
+            user_id=user_id,
+            username=username,
             api_type="Gemini AI",
             feature="hashtags",
             tokens=0,
@@ -380,67 +451,88 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await query.answer()
 
     data = query.data
+    action, _, url_key = data.partition('_')
+    url = context.bot_data.get('button_urls', {}).get(url_key)
 
-    if data.startswith('caption_'):
-        url = data.replace('caption_', '')
+    if url is None:
+        await query.message.reply_text("⌛ This button has expired. Please send the link again.")
+
+    elif action == 'caption':
         await query.message.reply_text("✍️ Generating AI caption...")
         try:
-            caption = await caption_gen.generate_caption(f"social media post from {url}")
+            topic = f"social media post from {url}"
+            cache_key = response_cache.topic_key("caption", topic)
+            caption = await response_cache.get(cache_key)
+            if caption is None:
+                caption = await caption_gen.generate_caption(topic)
+                if not is_error_response(caption):
+                    await response_cache.set(cache_key, caption)
             await query.message.reply_text(f"✨ **AI Caption:**\n\n{caption}")
         except Exception as e:
             await query.message.reply_text(f"❌ Error: {str(e)}")
 
-    elif data.startswith('hashtags_'):
-        url = data.replace('hashtags_', '')
+    elif action == 'hashtags':
         await query.message.reply_text("🔖 Generating hashtags...")
         try:
-            hashtags = await caption_gen.generate_hashtags(f"content from {url}")
+            topic = f"content from {url}"
+            cache_key = response_cache.topic_key("hashtags", topic)
+            hashtags = await response_cache.get(cache_key)
+            if hashtags is None:
+                hashtags = await caption_gen.generate_hashtags(topic)
+                if not is_error_response(hashtags):
+                    await response_cache.set(cache_key, hashtags)
             await query.message.reply_text(f"🔖 **Hashtags:**\n\n{hashtags}")
         except Exception as e:
             await query.message.reply_text(f"❌ Error: {str(e)}")
 
 
+@track_user_action("image_analysis", details="Image analysis requested")
 async def handle_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle photos sent by users and generate caption + hashtags."""
-    user = update.effective_user
-
-    # Track user activity
-    analytics.log_user_activity(
-        user_id=user.id,
-        username=user.username or "unknown",
-        first_name=user.first_name or "User",
-        action="image_analysis",
-        details="Image analysis requested"
-    )
+    user_id, username, _ = user_info(update)
 
     # Send processing message
     processing_msg = await update.message.reply_text("📸 Analyzing your image...\nGenerating caption and hashtags...")
 
-    import time
-    start_time = time.time()
+    start_time = perf_counter()
 
     try:
-        # Get the photo (largest size)
-        photo = update.message.photo[-1]
+        # Get the largest photo size that fits ANALYSIS_MAX_SIDE (sizes are
+        # sorted smallest first; fall back to the smallest if none fit)
+        sizes = update.message.photo
+        photo = next(
+            (p for p in reversed(sizes) if max(p.width, p.height) <= ANALYSIS_MAX_SIDE),
+            sizes[0]
+        )
 
-        # Download the photo
-        photo_file = await photo.get_file()
-        photo_path = f"downloads/photo_{user.id}_{photo.file_id}.jpg"
-        await photo_file.download_to_drive(photo_path)
+        # The same image always has the same file_unique_id, so a
+        # cache hit skips both the download and the Gemini call
+        cache_key = response_cache.file_key("image_analysis", photo.file_unique_id)
+        result = await response_cache.get(cache_key)
+        cached = result is not None
+
+        if cached:
+            file_size = (photo.file_size or 0) / 1024  # KB
+        else:
+            # Download the photo straight into memory (no temp file to clean up)
+            photo_file = await photo.get_file()
+            photo_data = await photo_file.download_as_bytearray()
 
-        # Get file size
-        file_size = os.path.getsize(photo_path) / 1024  # KB
+            # Get file size
+            file_size = len(photo_data) / 1024  # KB
 
-        # Analyze image and generate caption + hashtags
-        result = await caption_gen.analyze_image_and_generate(photo_path)
+            # Analyze image and generate caption + hashtags
+            result = await caption_gen.analyze_image_and_generate(photo_data)
+            if not is_error_response(result['caption']):
+                await response_cache.set(cache_key, result)
 
-        analysis_time = time.time() - start_time
+        analysis_time = perf_counter() - start_time
 
         # Delete processing message
         await processing_msg.delete()
 
-        # Track API usage (estimated - image analysis uses more tokens)
-        estimated_tokens = 500  # Average tokens for image analysis
+        # Track API usage (estimated - image analysis uses more tokens; cache hits cost nothing)
+        estimated_tokens = 0 if cached else 500  # Average tokens for image analysis
         estimated_cost = estimated_tokens * 0.000075 / 1000  # Output token cost
 
         # Send result - Caption and hashtags first
@@ -461,27 +553,24 @@ async def handle_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
         await update.message.reply_text(stats_text)
 
-        analytics.log_api_usage(
-            user_id=user.id,
-            username=user.username or "unknown",
-            api_type="Gemini AI",
-            feature="image_analysis",
-            tokens=estimated_tokens,
-            cost=estimated_cost,
-            success=True
-        )
-
-        # Clean up downloaded photo
-        if os.path.exists(photo_path):
-            os.remove(photo_path)
+        if not cached:
+            analytics.log_api_usage(
+                user_id=user_id,
+                username=username,
+                api_type="Gemini AI",
+                feature="image_analysis",
+                tokens=estimated_tokens,
+                cost=estimated_cost,
+                success=True
+            )
 
     except Exception as e:
-        logger.error(f"Photo handling error: {e}")
+        logger.error("Photo handling error: %s", e)
         await processing_msg.edit_text(f"❌ Error analyzing image: {str(e)}")
         # Track failed API call
         analytics.log_api_usage(
-            user_id=user.id,
-            username=user.username or "unknown",
+            user_id=user_id,
+            username=username,
             api_type="Gemini AI",
             feature="image_analysis",
             tokens=0,
@@ -493,7 +582,7 @@ async def handle_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Log errors."""
-    logger.error(f"Update {update} caused error {context.error}")
+    logger.error("Update %s caused error %s", update, context.error)
 
 
 async def post_init(application: Application):
@@ -505,7 +594,15 @@ async def post_init(application: Application):
         BotCommand("hashtags", "🔖 Generate hashtags"),
     ]
     await application.bot.set_my_commands(commands)
-    print("✅ Bot commands menu set up successfully!")
+    logger.info("✅ Bot commands menu set up successfully!")
+
+    # Connect to Gemini now so the first caption request doesn't pay for it
+    await caption_gen.warm_up()
+
+
+async def post_shutdown(application: Application):
+    """Write any queued analytics rows without blocking the event loop."""
+    await asyncio.to_thread(analytics.flush)
 
 
 def main():
@@ -514,15 +611,36 @@ def main():
     token = os.getenv('TELEGRAM_BOT_TOKEN')
 
     if not token:
-        print("❌ Error: TELEGRAM_BOT_TOKEN not found in .env file!")
-        print("Please create a .env file with your bot token.")
+        logger.error("❌ Error: TELEGRAM_BOT_TOKEN not found in .env file!")
+        logger.error("Please create a .env file with your bot token.")
         return
 
-    # Create application
-    application = Application.builder().token(token).build()
+    # Keep outgoing messages within Telegram's flood limits (30 msg/s overall,
+    # 20 msg/min per group); calls over the limit are queued and retried
+    rate_limiter = AIORateLimiter(
+        overall_max_rate=30,
+        overall_time_period=1,
+        group_max_rate=20,
+        group_time_period=60,
+        max_retries=3
+    )
+
+    # Create application. Updates are handled concurrently so one user's
+    # slow download or AI call doesn't hold up everyone else's. All Bot API
+    # calls share PTB's pooled httpx client; HTTP/2 lets them multiplex over
+    # one kept-alive TLS connection instead of opening one per request.
+    application = (
+        Application.builder()
+        .token(token)
+        .concurrent_updates(True)
+        .rate_limiter(rate_limiter)
+        .http_version("2")
+        .build()
+    )
 
     # Set up bot commands menu
     application.post_init = post_init
+    application.post_shutdown = post_shutdown
 
     # Add command handlers
     application.add_handler(CommandHandler("start", start))
@@ -543,8 +661,8 @@ def main():
     application.add_error_handler(error_handler)
 
     # Start the bot
-    print("🤖 Bot is starting...")
-    print("Press Ctrl+C to stop")
+    logger.info("🤖 Bot is starting...")
+    logger.info("Press Ctrl+C to stop")
     application.run_polling(allowed_updates=Update.ALL_TYPES)
 
 
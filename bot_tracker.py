@@ -4,7 +4,7 @@ Helper functions to track user activities and costs
 """
 
 from analytics import analytics
-from functools import wraps
+from functools import lru_cache, wraps
 import logging
 
 logger = logging.getLogger(__name__)
@@ -18,35 +18,43 @@ GEMINI_PRICING = {
         'avg_tokens_image': 500,       # Estimated tokens for image analysis
     }
 }
+_FLASH = GEMINI_PRICING['gemini-2.5-flash']
 
-def estimate_cost(feature: str, tokens: int = 0) -> float:
-    """Estimate cost based on feature and tokens."""
-    pricing = GEMINI_PRICING['gemini-2.5-flash']
 
+@lru_cache(maxsize=64)
+def estimate_cost(feature: str, tokens: int = 0) -> float:
+    """Estimate cost based on feature and tokens (pricing is constant, so results are cached)."""
     if feature == 'caption':
         # Caption generation
-        tokens = tokens or pricing['avg_tokens_caption']
-        return (tokens / 1000) * pricing['output_per_1k']
+        tokens = tokens or _FLASH['avg_tokens_caption']
+        return (tokens / 1000) * _FLASH['output_per_1k']
     elif feature == 'hashtags':
         # Hashtag generation
-        tokens = tokens or pricing['avg_tokens_caption']
-        return (tokens / 1000) * pricing['output_per_1k']
+        tokens = tokens or _FLASH['avg_tokens_caption']
+        return (tokens / 1000) * _FLASH['output_per_1k']
     elif feature == 'image_analysis':
         # Image analysis
-        tokens = tokens or pricing['avg_tokens_image']
-        return (tokens / 1000) * (pricing['input_per_1k'] + pricing['output_per_1k'])
+        tokens = tokens or _FLASH['avg_tokens_image']
+        return (tokens / 1000) * (_FLASH['input_per_1k'] + _FLASH['output_per_1k'])
     else:
         return 0.0
 
-def track_user_action(action: str):
-    """Decorator to track user actions."""
+def user_info(update) -> tuple:
+    """Return (user_id, username, first_name) with the fallbacks used in analytics rows."""
+    user = update.effective_user
+    return user.id, user.username or "unknown", user.first_name or "User"
+
+def track_user_action(action: str, details=None):
+    """
+    Decorator to track user actions.
+
+    details is either a fixed string or a callable taking the update,
+    for details that depend on the message (e.g. the URL sent).
+    """
     def decorator(func):
         @wraps(func)
         async def wrapper(update, context, *args, **kwargs):
-            user = update.effective_user
-            user_id = user.id
-            username = user.username or "Unknown"
-            first_name = user.first_name or "User"
+            user_id, username, first_name = user_info(update)
 
             # Log the action
             analytics.log_user_activity(
@@ -54,7 +62,7 @@ def track_user_action(action: str):
                 username=username,
                 first_name=first_name,
                 action=action,
-                details=None
+                details=details(update) if callable(details) else details
             )
 
             # Execute the original function
@@ -64,10 +72,6 @@ def track_user_action(action: str):
 
 def track_download(platform: str, content_type: str, success: bool = True):
     """Track download activity."""
-    def get_user_info(update):
-        user = update.effective_user
-        return user.id, user.username or "Unknown"
-
     def decorator(func):
         @wraps(func)
         async def wrapper(update, context, *args, **kwargs):
@@ -75,7 +79,7 @@ def track_download(platform: str, content_type: str, success: bool = True):
                 result = await func(update, context, *args, **kwargs)
 
                 # Track successful download
-                user_id, username = get_user_info(update)
+                user_id, username, _ = user_info(update)
                 analytics.log_download(
                     user_id=user_id,
                     username=username,
@@ -87,7 +91,7 @@ def track_download(platform: str, content_type: str, success: bool = True):
                 return result
             except Exception as e:
                 # Track failed download
-                user_id, username = get_user_info(update)
+                user_id, username, _ = user_info(update)
                 analytics.log_download(
                     user_id=user_id,
                     username=username,
@@ -3,15 +3,186 @@ AI Caption Generator Module
 Uses Google Gemini API to generate captions and hashtags
 """
 
+import io
 import os
+import asyncio
 import logging
+import re
 import google.generativeai as genai
+from google.api_core import exceptions as api_exceptions
 from dotenv import load_dotenv
-from PIL import Image
+
+from response_cache import STOPWORDS
 
 load_dotenv()
 logger = logging.getLogger(__name__)
 
+# Each retry gets a longer timeout (base timeout x factor), so a fast
+# first attempt fails quickly while a slow model still gets room to finish
+RETRY_TIMEOUT_FACTORS = (1, 1.5, 2.5)
+RETRY_BACKOFF = 0.5  # seconds before the 2nd attempt, doubled after that
+
+# Errors worth retrying (quota errors are not; retrying only burns quota)
+RETRYABLE_ERRORS = (
+    asyncio.TimeoutError,
+    api_exceptions.DeadlineExceeded,
+    api_exceptions.ServiceUnavailable,
+    api_exceptions.InternalServerError,
+)
+
+# Prompt templates, filled in with str.format. Kept free of leading and
+# trailing whitespace since every character is sent (and billed) as input.
+CAPTION_PROMPT = """\
+Create an {style} social media caption for: {topic}
+
+Requirements:
+- Make it catchy and attention-grabbing
+- Keep it under 150 characters
+- Include 1-2 relevant emojis
+- Perfect for Instagram/Facebook/TikTok
+- Target audience: 15-35 age group
+- Don't include hashtags (they'll be generated separately)
+
+Just return the caption, nothing else."""
+
+HASHTAGS_PROMPT = """\
+Generate {count} trending and relevant hashtags for: {topic}
+
+Requirements:
+- Mix of popular and niche hashtags
+- Relevant to 15-35 age group
+- Mix of broad and specific tags
+- Include trending tags when relevant
+- Perfect for Instagram/TikTok/Facebook
+
+Format: Return ONLY the hashtags separated by spaces, like:
+#hashtag1 #hashtag2 #hashtag3"""
+
+CAPTION_HASHTAGS_PROMPT = """\
+Create {style} social media content for: {topic}
+
+Tasks:
+1. Generate a catchy caption (under 150 characters, include 1-2 emojis)
+2. Generate {count} trending and relevant hashtags
+
+Requirements:
+- Caption should be attention-grabbing and {style}, without hashtags
+- Target audience: 15-35 age group
+- Perfect for Instagram/Facebook/TikTok
+- Hashtags: mix of popular and niche tags
+
+Format your response EXACTLY like this:
+CAPTION: [your caption here]
+HASHTAGS: #tag1 #tag2 #tag3 ..."""
+
+IMAGE_PROMPT = """\
+Analyze this image and create {style} social media content.
+
+Tasks:
+1. Generate a catchy caption (under 150 characters, include 1-2 emojis)
+2. Generate 15 relevant hashtags
+
+Requirements:
+- Caption should be attention-grabbing and {style}
+- Target audience: 15-35 age group
+- Perfect for Instagram/Facebook/TikTok
+- Hashtags: mix of popular and niche tags
+
+Format your response EXACTLY like this:
+CAPTION: [your caption here]
+HASHTAGS: #tag1 #tag2 #tag3 ..."""
+
+# "CAPTION: ..." / "HASHTAGS: ..." lines in a combined response
+RESPONSE_FIELD_RE = re.compile(r'^[ \t]*(CAPTION|HASHTAGS):(.*)$', re.MULTILINE)
+
+# Longest side (px) of images sent for analysis. Gemini bills images in
+# 768 px tiles, so anything bigger only costs more tokens and upload time.
+IMAGE_MAX_SIDE = 1024
+IMAGE_JPEG_QUALITY = 85
+
+# Offline templates used when Gemini is timing out or rate-limited
+FALLBACK_CAPTIONS = {
+    'engaging': "✨ {topic} vibes! 🌟",
+    'professional': "{topic}: quality you can count on. ✅",
+    'casual': "Just some {topic} 😎",
+    'funny': "Me? Obsessed with {topic}? Never. 😂",
+}
+
+# Evergreen tags per category, picked by keywords in the topic
+FALLBACK_HASHTAGS = {
+    'travel': "#travel #wanderlust #travelgram #explore #adventure #vacation #instatravel #traveltheworld",
+    'food': "#food #foodie #instafood #yummy #foodporn #delicious #foodlover #homemade",
+    'fitness': "#fitness #gym #workout #fitfam #health #motivation #training #fitspo",
+    'lifestyle': "#lifestyle #instagood #photooftheday #love #happy #instadaily #picoftheday #trending",
+}
+FALLBACK_CATEGORY_WORDS = {
+    'travel': {'travel', 'trip', 'beach', 'sunset', 'mountain', 'city', 'vacation', 'holiday', 'hiking'},
+    'food': {'food', 'coffee', 'pizza', 'cake', 'dinner', 'lunch', 'breakfast', 'recipe', 'cooking'},
+    'fitness': {'gym', 'workout', 'fitness', 'run', 'running', 'yoga', 'training', 'health'},
+}
+
+
+def _is_transient_error(error_msg: str) -> bool:
+    """Timeouts and rate limits, i.e. errors a fallback should cover."""
+    error_msg = error_msg.lower()
+    return any(word in error_msg for word in ('timeout', 'timed out', 'quota', 'limit', '429'))
+
+
+def _error_notice(error_msg: str, fallback: str,
+                  timed_out: str = "⚠️ AI generation timed out. Please try again with a shorter topic.") -> str:
+    """User-friendly message for a Gemini error; `fallback` for unrecognised ones."""
+    lowered = error_msg.lower()
+    if 'timeout' in lowered or 'timed out' in lowered:
+        return timed_out
+    if 'quota' in lowered or 'limit' in lowered:
+        return "⚠️ API quota exceeded. Please wait a few minutes and try again."
+    if '429' in error_msg:
+        return "⚠️ Too many requests. Please wait 1 minute and try again."
+    return fallback
+
+
+def _topic_words(topic: str) -> list:
+    """Meaningful words of a topic, in order, without duplicates."""
+    words = dict.fromkeys(re.findall(r'\w+', topic.lower()))
+    return [w for w in words if w not in STOPWORDS] or list(words)
+
+
+def _fallback_caption(topic: str, style: str = "engaging") -> str:
+    """Template caption for a topic, no API call."""
+    template = FALLBACK_CAPTIONS.get(style, FALLBACK_CAPTIONS['engaging'])
+    return template.format(topic=topic.strip().title())
+
+
+def _fallback_hashtags(topic: str, count: int = 15) -> str:
+    """Hashtags built from the topic's own words plus evergreen tags, no API call."""
+    words = _topic_words(topic)
+    category = next(
+        (name for name, keywords in FALLBACK_CATEGORY_WORDS.items() if keywords.intersection(words)),
+        'lifestyle'
+    )
+    tags = [f"#{w}" for w in words] + FALLBACK_HASHTAGS[category].split()
+    return ' '.join(list(dict.fromkeys(tags))[:count])
+
+
+def _downscale_image(image_data: bytes, mime_type: str) -> tuple:
+    """
+    Shrink an image to IMAGE_MAX_SIDE and re-encode it as JPEG.
+
+    Images that are already small enough are returned untouched.
+    Returns (data, mime_type).
+    """
+    # Imported here so the bot doesn't load Pillow until the first photo
+    from PIL import Image
+
+    img = Image.open(io.BytesIO(image_data))
+    if max(img.size) <= IMAGE_MAX_SIDE:
+        return bytes(image_data), mime_type
+
+    img.thumbnail((IMAGE_MAX_SIDE, IMAGE_MAX_SIDE), Image.Resampling.LANCZOS)
+    out = io.BytesIO()
+    img.convert('RGB').save(out, format='JPEG', quality=IMAGE_JPEG_QUALITY)
+    return out.getvalue(), 'image/jpeg'
+
 
 class CaptionGenerator:
     """Generate captions and hashtags using AI."""
@@ -29,13 +200,93 @@ class CaptionGenerator:
             logger.warning("GEMINI_API_KEY not found. AI features disabled.")
             self.enabled = False
 
-    async def generate_caption(self, topic: str, style: str = "engaging") -> str:
+        # Per-attempt timeouts in seconds. Flash usually answers in well
+        # under a second, so the text default is short; image analysis
+        # uploads the photo and needs longer.
+        self.timeout = float(os.getenv('GEMINI_TIMEOUT', '8'))
+        self.image_timeout = float(os.getenv('GEMINI_IMAGE_TIMEOUT', '20'))
+
+    async def warm_up(self):
+        """
+        Open the Gemini connection ahead of the first user request.
+
+        Uses count_tokens, which sets up the gRPC channel and TLS session
+        without generating anything (no output tokens billed).
+        """
+        if not self.enabled:
+            return
+
+        try:
+            await asyncio.wait_for(self.model.count_tokens_async("ping"), self.timeout)
+        except Exception as e:
+            logger.warning("Gemini warm-up failed: %s", e)
+
+    async def _stream_text(self, contents, on_text=None, timeout: float = None) -> str:
+        """
+        Stream a Gemini response and return the full text.
+
+        Chunks arrive as soon as they are generated, so slow responses
+        keep the connection busy instead of idling until the timeout.
+        If given, on_text is awaited with the text received so far
+        after each chunk (e.g. to show a partial result to the user).
+
+        Timeouts and transient server errors are retried with a longer
+        timeout each time (see RETRY_TIMEOUT_FACTORS).
+        """
+        return await self._with_retries(
+            lambda attempt_timeout: self._stream_once(contents, on_text, attempt_timeout),
+            timeout or self.timeout
+        )
+
+    async def _with_retries(self, request, timeout: float):
+        """
+        Await request(attempt_timeout), retrying timeouts and transient
+        server errors with a longer timeout each time.
+        """
+        for attempt, factor in enumerate(RETRY_TIMEOUT_FACTORS):
+            if attempt:
+                await asyncio.sleep(RETRY_BACKOFF * 2 ** (attempt - 1))
+            try:
+                return await asyncio.wait_for(request(timeout * factor), timeout * factor)
+            except RETRYABLE_ERRORS as e:
+                if attempt == len(RETRY_TIMEOUT_FACTORS) - 1:
+                    if isinstance(e, asyncio.TimeoutError):
+                        # Give the callers' 'timed out' error mapping a message to match
+                        raise TimeoutError(f"Gemini request timed out after {attempt + 1} attempts") from e
+                    raise
+                logger.warning("Gemini attempt %d failed: %r", attempt + 1, e)
+
+    async def _stream_once(self, contents, on_text, timeout: float) -> str:
+        """Make a single streamed Gemini request."""
+        response = await self.model.generate_content_async(
+            contents,
+            stream=True,
+            request_options={'timeout': timeout}
+        )
+
+        parts = []
+        async for chunk in response:
+            # chunk.text raises on a chunk without parts (e.g. a final chunk
+            # cut by the safety filter), which would lose the text so far
+            text = ''.join(part.text for part in chunk.parts) if chunk.candidates else ''
+            if not text:
+                continue
+            parts.append(text)
+            if on_text is not None:
+                await on_text(''.join(parts))
+
+        if not parts:
+            raise ValueError("Gemini returned no text (the response may have been blocked)")
+        return ''.join(parts)
+
+    async def generate_caption(self, topic: str, style: str = "engaging", on_text=None) -> str:
         """
         Generate a social media caption.
 
         Args:
             topic: Topic or description
             style: Caption style (engaging, professional, casual, funny)
+            on_text: Optional async callback receiving the partial caption
 
         Returns:
             Generated caption
@@ -44,50 +295,83 @@ class CaptionGenerator:
             return "⚠️ AI features are disabled. Please add GEMINI_API_KEY to .env file."
 
         try:
-            prompt = f"""
-Create an {style} social media caption for: {topic}
+            prompt = CAPTION_PROMPT.format(style=style, topic=topic)
 
-Requirements:
-- Make it catchy and attention-grabbing
-- Keep it under 150 characters
-- Include 1-2 relevant emojis
-- Perfect for Instagram/Facebook/TikTok
-- Target audience: 15-35 age group
-- Don't include hashtags (they'll be generated separately)
+            # Generate (streamed, with timeout handling)
+            caption = (await self._stream_text(prompt, on_text)).strip()
 
-Just return the caption, nothing else.
-            """
+            return caption
 
-            # Generate with timeout handling
-            response = self.model.generate_content(
-                prompt,
-                request_options={'timeout': 30}  # 30 second timeout
+        except Exception as e:
+            logger.error("Caption generation error: %s", e)
+            error_msg = str(e)
+
+            notice = _error_notice(error_msg, f"⚠️ Error generating caption: {error_msg}")
+            if not _is_transient_error(error_msg):
+                return notice
+
+            # Still give the user something usable while Gemini is unavailable
+            return f"{notice}\n\n💡 Quick suggestion: {_fallback_caption(topic, style)}"
+
+    async def generate_caption_variants(self, topic: str, style: str = "engaging", n: int = 3) -> list:
+        """
+        Generate n alternative captions with a single Gemini call.
+
+        Uses candidate_count, so all variants come back in one request
+        instead of n separate ones.
+
+        Args:
+            topic: Topic or description
+            style: Caption style (engaging, professional, casual, funny)
+            n: Number of variants (Gemini allows up to 8)
+
+        Returns:
+            List of captions (a single error message on failure)
+        """
+        if not self.enabled:
+            return ["⚠️ AI features are disabled. Please add GEMINI_API_KEY to .env file."]
+
+        try:
+            prompt = CAPTION_PROMPT.format(style=style, topic=topic)
+            config = genai.types.GenerationConfig(
+                candidate_count=n,
+                temperature=0.9,  # Higher than default so the variants differ
+                max_output_tokens=200
             )
-            caption = response.text.strip()
 
-            return caption
+            async def request(timeout):
+                response = await self.model.generate_content_async(
+                    prompt,
+                    generation_config=config,
+                    request_options={'timeout': timeout}
+                )
+                return [
+                    ''.join(part.text for part in candidate.content.parts).strip()
+                    for candidate in response.candidates
+                ]
+
+            variants = [text for text in await self._with_retries(request, self.timeout) if text]
+            return variants or [_fallback_caption(topic, style)]
 
         except Exception as e:
-            logger.error(f"Caption generation error: {e}")
+            logger.error("Caption variants generation error: %s", e)
             error_msg = str(e)
 
-            # User-friendly error messages
-            if 'timeout' in error_msg.lower() or 'timed out' in error_msg.lower():
-                return "⚠️ AI generation timed out. Please try again with a shorter topic."
-            elif 'quota' in error_msg.lower() or 'limit' in error_msg.lower():
-                return "⚠️ API quota exceeded. Please wait a few minutes and try again."
-            elif '429' in error_msg:
-                return "⚠️ Too many requests. Please wait 1 minute and try again."
+            notice = _error_notice(error_msg, f"⚠️ Error generating captions: {error_msg}")
+            if not _is_transient_error(error_msg):
+                return [notice]
 
-            return f"⚠️ Error generating caption: {error_msg}"
+            # Still give the user something usable while Gemini is unavailable
+            return [f"{notice}\n\n💡 Quick suggestion: {_fallback_caption(topic, style)}"]
 
-    async def generate_hashtags(self, topic: str, count: int = 15) -> str:
+    async def generate_hashtags(self, topic: str, count: int = 15, on_text=None) -> str:
         """
         Generate trending hashtags.
 
         Args:
             topic: Topic or description
             count: Number of hashtags (default: 15)
+            on_text: Optional async callback receiving the partial hashtags
 
         Returns:
             Space-separated hashtags
@@ -96,26 +380,10 @@ Just return the caption, nothing else.
             return "⚠️ AI features are disabled. Please add GEMINI_API_KEY to .env file."
 
         try:
-            prompt = f"""
-Generate {count} trending and relevant hashtags for: {topic}
+            prompt = HASHTAGS_PROMPT.format(count=count, topic=topic)
 
-Requirements:
-- Mix of popular and niche hashtags
-- Relevant to 15-35 age group
-- Mix of broad and specific tags
-- Include trending tags when relevant
-- Perfect for Instagram/TikTok/Facebook
-
-Format: Return ONLY the hashtags separated by spaces, like:
-#hashtag1 #hashtag2 #hashtag3
-            """
-
-            # Generate with timeout handling
-            response = self.model.generate_content(
-                prompt,
-                request_options={'timeout': 30}  # 30 second timeout
-            )
-            hashtags = response.text.strip()
+            # Generate (streamed, with timeout handling)
+            hashtags = (await self._stream_text(prompt, on_text)).strip()
 
             # Clean up the response
             hashtags = hashtags.replace('\n', ' ')
@@ -123,46 +391,101 @@ Format: Return ONLY the hashtags separated by spaces, like:
             return hashtags
 
         except Exception as e:
-            logger.error(f"Hashtag generation error: {e}")
+            logger.error("Hashtag generation error: %s", e)
             error_msg = str(e)
 
-            # User-friendly error messages
-            if 'timeout' in error_msg.lower() or 'timed out' in error_msg.lower():
-                return "⚠️ AI generation timed out. Please try again."
-            elif 'quota' in error_msg.lower() or 'limit' in error_msg.lower():
-                return "⚠️ API quota exceeded. Please wait a few minutes and try again."
-            elif '429' in error_msg:
-                return "⚠️ Too many requests. Please wait 1 minute and try again."
+            notice = _error_notice(error_msg, f"⚠️ Error generating hashtags: {error_msg}",
+                                   timed_out="⚠️ AI generation timed out. Please try again.")
+            if not _is_transient_error(error_msg):
+                return notice
 
-            return f"⚠️ Error generating hashtags: {error_msg}"
+            # Still give the user something usable while Gemini is unavailable
+            return f"{notice}\n\n💡 Quick suggestion: {_fallback_hashtags(topic, count)}"
 
-    async def generate_caption_with_hashtags(self, topic: str, style: str = "engaging") -> dict:
+    async def generate_caption_with_hashtags(self, topic: str, style: str = "engaging",
+                                             count: int = 15) -> dict:
         """
-        Generate both caption and hashtags.
+        Generate both caption and hashtags with a single Gemini call.
 
         Args:
             topic: Topic or description
             style: Caption style
+            count: Number of hashtags (default: 15)
 
         Returns:
-            dict with 'caption' and 'hashtags'
+            dict with 'caption', 'hashtags', and 'full_text'
         """
-        caption = await self.generate_caption(topic, style)
-        hashtags = await self.generate_hashtags(topic)
+        if not self.enabled:
+            return {
+                'caption': "⚠️ AI features are disabled. Please add GEMINI_API_KEY to .env file.",
+                'hashtags': "",
+                'full_text': "⚠️ AI features are disabled."
+            }
 
-        return {
-            'caption': caption,
-            'hashtags': hashtags,
-            'full_text': f"{caption}\n\n{hashtags}"
-        }
+        try:
+            prompt = CAPTION_HASHTAGS_PROMPT.format(style=style, topic=topic, count=count)
 
-    async def analyze_image_and_generate(self, image_path: str, style: str = "engaging") -> dict:
+            result_text = await self._stream_text(prompt)
+            caption, hashtags = self._parse_caption_hashtags(result_text.strip())
+
+            return {
+                'caption': caption,
+                'hashtags': hashtags,
+                'full_text': f"{caption}\n\n{hashtags}" if hashtags else caption
+            }
+
+        except Exception as e:
+            logger.error("Caption + hashtag generation error: %s", e)
+            error_msg = str(e)
+
+            error_text = _error_notice(error_msg, f"⚠️ Error generating content: {error_msg}")
+
+            if _is_transient_error(error_msg):
+                # Still give the user something usable while Gemini is unavailable
+                caption = f"{error_text}\n\n💡 Quick suggestion: {_fallback_caption(topic, style)}"
+                hashtags = _fallback_hashtags(topic, count)
+                return {
+                    'caption': caption,
+                    'hashtags': hashtags,
+                    'full_text': f"{caption}\n\n{hashtags}"
+                }
+
+            return {
+                'caption': error_text,
+                'hashtags': "",
+                'full_text': error_text
+            }
+
+    @staticmethod
+    def _parse_caption_hashtags(result_text: str, default_caption: str = "✨ Content generated successfully!") -> tuple:
+        """Split a CAPTION:/HASHTAGS: formatted response into (caption, hashtags)."""
+        # One pass over the text; a later line wins if a field repeats
+        fields = dict(RESPONSE_FIELD_RE.findall(result_text))
+        caption = fields.get('CAPTION', '').strip()
+        hashtags = fields.get('HASHTAGS', '').strip()
+
+        # Fallback if parsing fails
+        if not caption and not hashtags:
+            # Try to split by any obvious delimiter
+            parts = result_text.split('\n\n')
+            if len(parts) >= 2:
+                caption = parts[0].strip()
+                hashtags = parts[1].strip()
+            else:
+                caption = result_text.strip()
+                hashtags = ""
+
+        return caption or default_caption, hashtags
+
+    async def analyze_image_and_generate(self, image_data: bytes, style: str = "engaging",
+                                         mime_type: str = "image/jpeg") -> dict:
         """
         Analyze an image and generate caption + hashtags.
 
         Args:
-            image_path: Path to the image file
+            image_data: Raw image bytes
             style: Caption style (engaging, professional, casual, funny)
+            mime_type: MIME type of image_data (Telegram photos are JPEG)
 
         Returns:
             dict with 'caption', 'hashtags', and 'full_text'
@@ -175,76 +498,34 @@ Format: Return ONLY the hashtags separated by spaces, like:
             }
 
         try:
-            # Load the image
-            img = Image.open(image_path)
+            # Downscale oversized images (CPU work, so off the event loop),
+            # then send the bytes to Gemini as an inline blob
+            data, mime_type = await asyncio.to_thread(_downscale_image, image_data, mime_type)
+            img = {'mime_type': mime_type, 'data': data}
 
             # Prompt for analyzing image and generating content
-            prompt = f"""
-Analyze this image and create {style} social media content.
-
-Tasks:
-1. Generate a catchy caption (under 150 characters, include 1-2 emojis)
-2. Generate 15 relevant hashtags
-
-Requirements:
-- Caption should be attention-grabbing and {style}
-- Target audience: 15-35 age group
-- Perfect for Instagram/Facebook/TikTok
-- Hashtags: mix of popular and niche tags
-
-Format your response EXACTLY like this:
-CAPTION: [your caption here]
-HASHTAGS: #tag1 #tag2 #tag3 ...
-            """
+            prompt = IMAGE_PROMPT.format(style=style)
 
             # Generate with image and timeout handling
-            response = self.model.generate_content(
-                [prompt, img],
-                request_options={'timeout': 30}
-            )
-            result_text = response.text.strip()
+            result_text = await self._stream_text([prompt, img], timeout=self.image_timeout)
 
             # Parse the response
-            caption = ""
-            hashtags = ""
-
-            lines = result_text.split('\n')
-            for line in lines:
-                if line.startswith('CAPTION:'):
-                    caption = line.replace('CAPTION:', '').strip()
-                elif line.startswith('HASHTAGS:'):
-                    hashtags = line.replace('HASHTAGS:', '').strip()
-
-            # Fallback if parsing fails
-            if not caption and not hashtags:
-                # Try to split by any obvious delimiter
-                parts = result_text.split('\n\n')
-                if len(parts) >= 2:
-                    caption = parts[0].strip()
-                    hashtags = parts[1].strip()
-                else:
-                    caption = result_text.strip()
-                    hashtags = ""
+            caption, hashtags = self._parse_caption_hashtags(
+                result_text.strip(), "✨ Image analyzed successfully!"
+            )
 
             return {
-                'caption': caption or "✨ Image analyzed successfully!",
+                'caption': caption,
                 'hashtags': hashtags,
                 'full_text': f"{caption}\n\n{hashtags}" if hashtags else caption
             }
 
         except Exception as e:
-            logger.error(f"Image analysis error: {e}")
+            logger.error("Image analysis error: %s", e)
             error_msg = str(e)
 
-            # User-friendly error messages
-            if 'timeout' in error_msg.lower() or 'timed out' in error_msg.lower():
-                error_text = "⚠️ Image analysis timed out. Please try with a smaller image."
-            elif 'quota' in error_msg.lower() or 'limit' in error_msg.lower():
-                error_text = "⚠️ API quota exceeded. Please wait a few minutes and try again."
-            elif '429' in error_msg:
-                error_text = "⚠️ Too many requests. Please wait 1 minute and try again."
-            else:
-                error_text = f"⚠️ Error analyzing image: {error_msg}"
+            error_text = _error_notice(error_msg, f"⚠️ Error analyzing image: {error_msg}",
+                                       timed_out="⚠️ Image analysis timed out. Please try with a smaller image.")
 
             return {
                 'caption': error_text,
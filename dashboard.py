@@ -8,18 +8,22 @@ import subprocess
 import psutil
 import os
 import time
+import shutil
+import threading
 from datetime import datetime
 from dotenv import load_dotenv
-import json
-import pandas as pd
-import plotly.express as px
-from analytics import Analytics
+
+# pandas, plotly and analytics are imported where they're used, so the
+# pages that don't need them (Home, Settings, Logs) load faster
 
 # Load environment variables
 load_dotenv()
 
-# Initialize analytics
-analytics = Analytics()
+# Analytics instance: the module's global one, so every session shares
+# its connection and background writer
+def get_analytics():
+    from analytics import analytics
+    return analytics
 
 # Page config
 st.set_page_config(
@@ -66,21 +70,168 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
+# PID of the running bot, so status checks don't scan the process table
+BOT_PID_FILE = 'bot.pid'
+
+# Seconds between background checks of the bot process
+BOT_STATUS_POLL_SECONDS = 3
+
+# Display format for the numeric percentage columns of process tables
+PERCENT_COLUMNS = {
+    'CPU %': st.column_config.NumberColumn(format="%.1f%%"),
+    'Memory %': st.column_config.NumberColumn(format="%.1f%%"),
+}
+
 # Helper functions
-def check_bot_status():
-    """Check if bot is running"""
-    for proc in psutil.process_iter(['pid', 'name', 'cmdline']):
+def runs_bot_script(cmdline):
+    """True if a command line runs bot.py (checks each argument, no joining)."""
+    return bool(cmdline) and any(arg.endswith('bot.py') for arg in cmdline)
+
+def is_bot_process(proc):
+    """True if proc is alive and running bot.py."""
+    try:
+        return (proc.is_running() and proc.status() != psutil.STATUS_ZOMBIE
+                and runs_bot_script(proc.cmdline()))
+    except (psutil.NoSuchProcess, psutil.AccessDenied):
+        return False
+
+def get_bot_process():
+    """Return the running bot's psutil.Process, or None."""
+    try:
+        with open(BOT_PID_FILE) as f:
+            proc = psutil.Process(int(f.read().strip()))
+        if is_bot_process(proc):
+            return proc
+    except (OSError, ValueError, psutil.NoSuchProcess):
+        pass
+
+    # No usable PID file (e.g. the bot was started from a terminal):
+    # fall back to one scan and remember the PID for the next check
+    for proc in psutil.process_iter(['cmdline']):
+        cmdline = proc.info['cmdline']
+        if runs_bot_script(cmdline) and 'python' in cmdline[0].lower():
+            with open(BOT_PID_FILE, 'w') as f:
+                f.write(str(proc.pid))
+            return proc
+    return None
+
+@st.cache_resource
+def process_table():
+    """psutil.Process objects by PID, kept across reruns."""
+    return {}
+
+@st.cache_resource
+def cpu_primed_pids():
+    """PIDs whose cached Process already has a cpu_percent reference sample."""
+    return set()
+
+@st.cache_data(ttl=3)
+def python_processes():
+    """
+    Info dicts for running Python processes (cached for 3 seconds).
+
+    Only the name is read for every process; the other fields are read
+    just for Python ones. Process objects are reused between reruns
+    (only new PIDs get one). CPU usage isn't included; see
+    process_cpu_percent.
+    """
+    procs = process_table()
+    current = set(psutil.pids())
+    for pid in procs.keys() - current:
+        del procs[pid]
+    cpu_primed_pids().intersection_update(current)
+    for pid in current - procs.keys():
         try:
-            cmdline = proc.info['cmdline']
-            if cmdline and 'python' in cmdline[0].lower() and 'bot.py' in ' '.join(cmdline):
-                return True, proc.info['pid']
+            procs[pid] = psutil.Process(pid)
+        except psutil.NoSuchProcess:
+            continue
+
+    result = []
+    for proc in list(procs.values()):
+        try:
+            with proc.oneshot():
+                if 'python' not in proc.name().lower():
+                    continue
+                result.append(proc.as_dict(
+                    ['pid', 'name', 'cmdline', 'memory_percent', 'create_time']
+                ))
         except (psutil.NoSuchProcess, psutil.AccessDenied):
             continue
-    return False, None
+    return result
+
+def process_cpu_percent(pids):
+    """
+    CPU % of a few processes from python_processes, by PID.
+
+    A process's first cpu_percent reading is always 0.0, so processes
+    seen for the first time share one 0.1 s sample; the rest report
+    usage since the previous render.
+    """
+    procs = process_table()
+    primed = cpu_primed_pids()
+
+    fresh = [pid for pid in pids if pid not in primed]
+    for pid in fresh:
+        try:
+            procs[pid].cpu_percent(None)
+        except (KeyError, psutil.NoSuchProcess, psutil.AccessDenied):
+            continue
+    if fresh:
+        time.sleep(0.1)
+        primed.update(fresh)
+
+    usage = {}
+    for pid in pids:
+        try:
+            usage[pid] = procs[pid].cpu_percent(None)
+        except (KeyError, psutil.NoSuchProcess, psutil.AccessDenied):
+            usage[pid] = 0.0
+    return usage
+
+def read_bot_status():
+    """Look the bot process up: (is_running, pid)."""
+    proc = get_bot_process()
+    return (True, proc.pid) if proc else (False, None)
+
+@st.cache_resource
+def bot_status_poller():
+    """Latest bot status, kept fresh by a daemon thread off the render path."""
+    latest = {'status': read_bot_status()}
+
+    def poll():
+        while True:
+            time.sleep(BOT_STATUS_POLL_SECONDS)
+            latest['status'] = read_bot_status()
+
+    threading.Thread(target=poll, name='bot-status-poller', daemon=True).start()
+    return latest
+
+def check_bot_status():
+    """Check if bot is running (reads the poller's latest result)"""
+    return bot_status_poller()['status']
+
+def refresh_bot_status():
+    """Update the shared status right away (after starting/stopping the bot)."""
+    bot_status_poller()['status'] = read_bot_status()
+
+@st.cache_resource
+def bot_start_lock():
+    """Serializes starts across reruns and sessions (one bot at a time)."""
+    return threading.Lock()
 
 def start_bot():
     """Start the bot"""
+    lock = bot_start_lock()
+    if not lock.acquire(blocking=False):
+        return False, "The bot is already being started."
+
     try:
+        # A double click or a second browser tab may have started it already
+        proc = get_bot_process()
+        if proc is not None:
+            refresh_bot_status()
+            return True, f"Bot is already running (PID: {proc.pid})"
+
         # Get the correct Python executable from virtual environment
         python_path = './venv/bin/python'
 
@@ -89,55 +240,85 @@ def start_bot():
             import sys
             python_path = sys.executable
 
-        # Start bot in background
+        # Start bot in background. Its output is discarded rather than piped:
+        # nothing reads the pipes, so the bot would block once they filled up.
         process = subprocess.Popen(
             [python_path, 'bot.py'],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
             cwd=os.getcwd()
         )
-        time.sleep(2)  # Wait for bot to start
-        return True, f"Bot started successfully! (PID: {process.pid})"
+        with open(BOT_PID_FILE, 'w') as f:
+            f.write(str(process.pid))
+        refresh_bot_status()
+
+        # Give the bot a moment to fail on startup (bad token, missing
+        # packages); returns straight away if it exits
+        try:
+            returncode = process.wait(timeout=2)
+        except subprocess.TimeoutExpired:
+            return True, f"Bot started successfully! (PID: {process.pid})"
+
+        os.remove(BOT_PID_FILE)
+        refresh_bot_status()
+        return False, f"Bot exited right after starting (exit code {returncode}). Run 'python bot.py' to see why."
     except Exception as e:
         return False, f"Error starting bot: {str(e)}"
+    finally:
+        lock.release()
 
 def stop_bot():
     """Stop the bot"""
     try:
-        # Kill all bot processes
-        result = subprocess.run(['pkill', '-9', '-f', 'python.*bot.py'],
-                              capture_output=True, text=True)
-        time.sleep(2)  # Give it time to fully stop
-
-        # Verify it's stopped
-        is_running, _ = check_bot_status()
-        if is_running:
-            return False, "Bot is still running. Try again."
+        proc = get_bot_process()
+        if proc is None:
+            return True, "Bot is not running."
+
+        # Ask the bot to shut down cleanly (flushes analytics), then force
+        # it; wait_procs returns as soon as the process has been reaped
+        proc.terminate()
+        _, alive = psutil.wait_procs([proc], timeout=5)
+        for survivor in alive:
+            survivor.kill()
+        _, alive = psutil.wait_procs(alive, timeout=5)
+        if alive:
+            return False, f"Bot (PID: {proc.pid}) is still running."
+
+        if os.path.exists(BOT_PID_FILE):
+            os.remove(BOT_PID_FILE)
+        refresh_bot_status()
 
         return True, "Bot stopped successfully!"
     except Exception as e:
         return False, f"Error stopping bot: {str(e)}"
 
-def get_bot_info():
-    """Get bot information"""
-    token = os.getenv('TELEGRAM_BOT_TOKEN', 'Not set')
-    gemini_key = os.getenv('GEMINI_API_KEY', 'Not set')
-
-    # Mask sensitive info
-    if token != 'Not set':
-        token = token[:10] + '...' + token[-5:]
-    if gemini_key != 'Not set':
-        gemini_key = gemini_key[:10] + '...' + gemini_key[-5:]
+def mask_secret(value):
+    """Show only the ends of a secret, or 'Not set' when it is missing."""
+    return f"{value[:10]}...{value[-5:]}" if value else 'Not set'
 
+@st.cache_data
+def get_bot_info():
+    """Get bot information (env vars don't change while the dashboard runs)"""
     return {
-        'token': token,
-        'gemini_key': gemini_key,
+        'token': mask_secret(os.getenv('TELEGRAM_BOT_TOKEN')),
+        'gemini_key': mask_secret(os.getenv('GEMINI_API_KEY')),
         'bot_username': '@MySocialMediaTckBot'
     }
 
+@st.cache_resource
+def cpu_sampler():
+    """Start psutil's CPU sampling once per process (first reading is meaningless)."""
+    psutil.cpu_percent(interval=None)
+    return {'last': 0.0}
+
+@st.cache_data(ttl=2)
 def get_system_stats():
     """Get system resource usage"""
-    cpu_percent = psutil.cpu_percent(interval=1)
+    # Non-blocking: usage since the previous call instead of sleeping 1 s.
+    # Calls too close together read 0.0, so keep showing the last value.
+    sampler = cpu_sampler()
+    cpu_percent = psutil.cpu_percent(interval=None) or sampler['last']
+    sampler['last'] = cpu_percent
     memory = psutil.virtual_memory()
     disk = psutil.disk_usage('/')
 
@@ -147,6 +328,98 @@ def get_system_stats():
         'disk': disk.percent
     }
 
+@st.cache_data(ttl=30)
+def get_analytics_snapshot():
+    """Every Analytics page statistic, queried at most every 30 seconds"""
+    analytics = get_analytics()
+    snapshot = analytics.get_dashboard_snapshot(top_users=10, recent=20)
+    snapshot['downloaded_bytes'] = analytics.get_downloaded_bytes()
+    return snapshot
+
+def rows_to_arrow(rows, columns):
+    """Arrow table straight from query rows (st.dataframe's wire format, no pandas)"""
+    import pyarrow as pa
+
+    return pa.table(dict(zip(columns, map(list, zip(*rows)))))
+
+# Tables and charts are pure functions of the query rows, so they are
+# cached on those rows; uirevision keeps zoom/selection across reruns
+@st.cache_data(ttl=30)
+def build_cost_chart(rows, columns):
+    """Cost-by-feature table and pie chart"""
+    import pandas as pd
+    import plotly.express as px
+
+    raw = pd.DataFrame.from_records(rows, columns=columns)
+    df = pd.DataFrame({
+        'Feature': raw['api_type'].astype(str) + ' - ' + raw['feature'].astype(str),
+        'Calls': raw['calls'],
+        'Total Cost': raw['total_cost'].round(4),
+        'Avg Cost': raw['avg_cost'].round(6)
+    })
+    fig = px.pie(df, values='Total Cost', names='Feature', title='Cost Distribution')
+    fig.update_layout(uirevision='constant')
+    return df, fig
+
+@st.cache_data(ttl=30)
+def build_feature_chart(rows):
+    """Feature usage table and bar chart"""
+    import pandas as pd
+    import plotly.express as px
+
+    df = pd.DataFrame(rows, columns=['Feature', 'Usage Count', 'Total Cost', 'Total Tokens'])
+    fig = px.bar(df, x='Feature', y='Usage Count', title='Feature Usage')
+    fig.update_layout(uirevision='constant')
+    return df, fig
+
+@st.cache_data(ttl=30)
+def build_platform_chart(rows):
+    """Downloads-by-platform table and stacked bar chart"""
+    import pandas as pd
+    import plotly.express as px
+
+    df = pd.DataFrame(rows, columns=['Platform', 'Total', 'Successful', 'Failed'])
+    fig = px.bar(df, x='Platform', y=['Successful', 'Failed'],
+                 title='Downloads by Platform', barmode='stack')
+    fig.update_layout(uirevision='constant')
+    return df, fig
+
+@st.cache_data(ttl=5)
+def get_tasks_snapshot():
+    """Recent download and API tasks (Tasks and Analytics pages), cached for 5 seconds"""
+    return get_analytics().get_tasks_snapshot(limit=15)
+
+def show_bot_status():
+    """Bot online/offline indicator (rendered as an auto-refreshing fragment)."""
+    is_running, pid = check_bot_status()
+
+    st.subheader("Bot Status")
+    if is_running:
+        st.markdown(f'<p class="status-online">🟢 ONLINE</p>', unsafe_allow_html=True)
+        st.caption(f"Process ID: {pid}")
+    else:
+        st.markdown(f'<p class="status-offline">🔴 OFFLINE</p>', unsafe_allow_html=True)
+        st.caption("Bot is not running")
+
+def show_system_resources():
+    """CPU/memory/disk gauges (rendered as an auto-refreshing fragment)."""
+    st.subheader("💻 System Resources")
+    stats = get_system_stats()
+
+    col1, col2, col3 = st.columns(3)
+
+    with col1:
+        st.metric("CPU Usage", f"{stats['cpu']}%")
+        st.progress(stats['cpu'] / 100)
+
+    with col2:
+        st.metric("Memory Usage", f"{stats['memory']:.1f}%")
+        st.progress(stats['memory'] / 100)
+
+    with col3:
+        st.metric("Disk Usage", f"{stats['disk']:.1f}%")
+        st.progress(stats['disk'] / 100)
+
 # Main Dashboard
 def main():
     # Header
@@ -165,35 +438,30 @@ def main():
         if st.button("🔄 Refresh"):
             st.rerun()
 
-    # Check bot status
-    is_running, pid = check_bot_status()
-
     # Home Page
     if page == "🏠 Home":
+        # Bot status for the control buttons
+        is_running, _ = check_bot_status()
+
         # Status Section
         col1, col2, col3 = st.columns([2, 2, 1])
 
+        with col3:
+            st.subheader("Auto Refresh")
+            auto_refresh = st.checkbox("Enable", value=False)
+
+        # Live sections re-run on their own every 5 s without blocking the
+        # page or re-running the rest of the script
+        refresh_every = "5s" if auto_refresh else None
+
         with col1:
-            st.subheader("Bot Status")
-            if is_running:
-                st.markdown(f'<p class="status-online">🟢 ONLINE</p>', unsafe_allow_html=True)
-                st.caption(f"Process ID: {pid}")
-            else:
-                st.markdown(f'<p class="status-offline">🔴 OFFLINE</p>', unsafe_allow_html=True)
-                st.caption("Bot is not running")
+            st.fragment(show_bot_status, run_every=refresh_every)()
 
         with col2:
             st.subheader("Quick Stats")
             bot_info = get_bot_info()
             st.metric("Bot Username", bot_info['bot_username'])
 
-        with col3:
-            st.subheader("Auto Refresh")
-            auto_refresh = st.checkbox("Enable", value=False)
-            if auto_refresh:
-                time.sleep(5)
-                st.rerun()
-
         st.divider()
 
         # Control Buttons
@@ -238,22 +506,7 @@ def main():
         st.divider()
 
         # System Resources
-        st.subheader("💻 System Resources")
-        stats = get_system_stats()
-
-        col1, col2, col3 = st.columns(3)
-
-        with col1:
-            st.metric("CPU Usage", f"{stats['cpu']}%")
-            st.progress(stats['cpu'] / 100)
-
-        with col2:
-            st.metric("Memory Usage", f"{stats['memory']:.1f}%")
-            st.progress(stats['memory'] / 100)
-
-        with col3:
-            st.metric("Disk Usage", f"{stats['disk']:.1f}%")
-            st.progress(stats['disk'] / 100)
+        st.fragment(show_system_resources, run_every=refresh_every)()
 
         st.divider()
 
@@ -302,16 +555,15 @@ def main():
         st.subheader("📁 File Management")
 
         if os.path.exists('downloads'):
-            files = os.listdir('downloads')
-            st.info(f"Downloaded files: {len(files)}")
+            with os.scandir('downloads') as entries:
+                file_count = sum(1 for _ in entries)
+            st.info(f"Downloaded files: {file_count}")
 
-            if files:
+            if file_count:
                 if st.button("🗑️ Clean Downloads Folder"):
-                    for file in files:
-                        try:
-                            os.remove(os.path.join('downloads', file))
-                        except:
-                            pass
+                    # Drop the whole folder in one call and recreate it empty
+                    shutil.rmtree('downloads', ignore_errors=True)
+                    os.makedirs('downloads', exist_ok=True)
                     st.success("Downloads folder cleaned!")
                     st.rerun()
         else:
@@ -332,11 +584,13 @@ def main():
     # Analytics Page
     elif page == "📊 Analytics":
         st.header("📊 Bot Analytics & Cost Tracking")
+        import pandas as pd
 
         # Get stats
-        total_stats = analytics.get_total_stats()
-        today_stats = analytics.get_today_stats()
-        monthly_estimate = analytics.estimate_monthly_cost()
+        snapshot = get_analytics_snapshot()
+        total_stats = snapshot['total_stats']
+        today_stats = snapshot['today_stats']
+        monthly_estimate = snapshot['monthly_estimate']
 
         # Overview Section
         st.subheader("📈 Overview")
@@ -380,39 +634,26 @@ def main():
 
         with col1:
             st.markdown("**Cost by Feature**")
-            cost_breakdown = analytics.get_cost_breakdown()
-
-            if cost_breakdown:
-                cost_data = []
-                for api_type, features in cost_breakdown.items():
-                    for feature in features:
-                        cost_data.append({
-                            'Feature': f"{api_type} - {feature['feature']}",
-                            'Calls': feature['calls'],
-                            'Total Cost': feature['total_cost'],
-                            'Avg Cost': feature['avg_cost']
-                        })
-
-                if cost_data:
-                    df = pd.DataFrame(cost_data)
-                    st.dataframe(df, use_container_width=True)
-
-                    # Pie chart
-                    fig = px.pie(df, values='Total Cost', names='Feature', title='Cost Distribution')
-                    st.plotly_chart(fig, use_container_width=True)
+            cost_rows, cost_columns = snapshot['cost_breakdown_flat']
+
+            if cost_rows:
+                df, fig = build_cost_chart(cost_rows, cost_columns)
+                st.dataframe(df, use_container_width=True)
+
+                # Pie chart
+                st.plotly_chart(fig, use_container_width=True)
             else:
                 st.info("No cost data available yet. Start using the bot!")
 
         with col2:
             st.markdown("**Feature Usage**")
-            feature_usage = analytics.get_feature_usage()
+            feature_usage = snapshot['feature_usage']
 
             if feature_usage:
-                df_features = pd.DataFrame(feature_usage, columns=['Feature', 'Usage Count', 'Total Cost', 'Total Tokens'])
+                df_features, fig = build_feature_chart(feature_usage)
                 st.dataframe(df_features, use_container_width=True)
 
                 # Bar chart
-                fig = px.bar(df_features, x='Feature', y='Usage Count', title='Feature Usage')
                 st.plotly_chart(fig, use_container_width=True)
             else:
                 st.info("No usage data available yet.")
@@ -426,7 +667,7 @@ def main():
 
         with col1:
             st.markdown("**Top Users**")
-            top_users = analytics.get_top_users(limit=10)
+            top_users = snapshot['top_users']
 
             if top_users:
                 df_users = pd.DataFrame(
@@ -439,19 +680,15 @@ def main():
 
         with col2:
             st.markdown("**Recent Activity**")
-            recent = analytics.get_recent_activity(limit=20)
+            recent = snapshot['recent_activity']
 
             if recent:
-                df_recent = pd.DataFrame(
-                    recent,
-                    columns=['Timestamp', 'Username', 'Name', 'Action', 'Details']
+                # Show time only (timestamps are stored as 'YYYY-MM-DD HH:MM:SS')
+                table = rows_to_arrow(
+                    [(timestamp[11:19], *rest) for timestamp, *rest in recent],
+                    ['Time', 'Username', 'Name', 'Action', 'Details']
                 )
-
-                # Format timestamp to show time only
-                df_recent['Time'] = pd.to_datetime(df_recent['Timestamp']).dt.strftime('%H:%M:%S')
-                df_recent = df_recent[['Time', 'Username', 'Name', 'Action', 'Details']]
-
-                st.dataframe(df_recent, use_container_width=True, height=400)
+                st.dataframe(table, use_container_width=True, height=400)
             else:
                 st.info("No recent activity.")
 
@@ -460,13 +697,10 @@ def main():
         # Download Statistics
         st.subheader("📥 Download Statistics")
 
-        platform_stats = analytics.get_platform_downloads()
+        platform_stats = snapshot['platform_downloads']
 
         if platform_stats:
-            df_downloads = pd.DataFrame(
-                platform_stats,
-                columns=['Platform', 'Total', 'Successful', 'Failed']
-            )
+            df_downloads, platform_fig = build_platform_chart(platform_stats)
 
             col1, col2, col3 = st.columns([2, 1, 1])
 
@@ -479,43 +713,23 @@ def main():
                 st.metric("Success Rate", f"{success_rate:.1f}%")
 
             with col3:
-                # Get total file size from database
-                conn = analytics.conn = __import__('sqlite3').connect('analytics.db')
-                cursor = conn.cursor()
-                cursor.execute('SELECT SUM(file_size) FROM downloads WHERE success = 1')
-                total_bytes = cursor.fetchone()[0] or 0
-                conn.close()
-
-                total_mb = total_bytes / (1024 * 1024)
+                total_mb = snapshot['downloaded_bytes'] / (1024 * 1024)
                 st.metric("Total Downloaded", f"{total_mb:.1f} MB")
                 st.metric("Avg File Size", f"{total_mb / max(df_downloads['Successful'].sum(), 1):.1f} MB")
 
             # Platform distribution
-            fig = px.bar(df_downloads, x='Platform', y=['Successful', 'Failed'],
-                         title='Downloads by Platform', barmode='stack')
-            st.plotly_chart(fig, use_container_width=True)
+            st.plotly_chart(platform_fig, use_container_width=True)
 
             # Recent downloads with details
             st.markdown("**Recent Downloads (with file sizes)**")
-            cursor = conn = __import__('sqlite3').connect('analytics.db').cursor()
-            cursor.execute('''
-                SELECT timestamp, username, platform, content_type,
-                       CASE WHEN success = 1 THEN 'Success' ELSE 'Failed' END as status,
-                       ROUND(file_size / 1024.0 / 1024.0, 2) as size_mb
-                FROM downloads
-                ORDER BY timestamp DESC
-                LIMIT 10
-            ''')
-            recent_downloads = cursor.fetchall()
-            cursor.connection.close()
+            recent_downloads = get_tasks_snapshot()['recent_downloads'][:10]
 
             if recent_downloads:
-                df_recent_dl = pd.DataFrame(
-                    recent_downloads,
-                    columns=['Time', 'User', 'Platform', 'Type', 'Status', 'Size (MB)']
+                table = rows_to_arrow(
+                    [(*row[:4], 'Success' if row[4] else 'Failed', row[5]) for row in recent_downloads],
+                    ['Time', 'User', 'Platform', 'Type', 'Status', 'Size (MB)']
                 )
-                df_recent_dl['Time'] = pd.to_datetime(df_recent_dl['Time']).dt.strftime('%H:%M:%S')
-                st.dataframe(df_recent_dl, use_container_width=True)
+                st.dataframe(table, use_container_width=True)
         else:
             st.info("No download statistics available yet.")
 
@@ -542,7 +756,7 @@ def main():
         # Error Tracking
         st.subheader("⚠️ Error Statistics")
 
-        error_stats = analytics.get_error_stats()
+        error_stats = snapshot['error_stats']
 
         if error_stats:
             df_errors = pd.DataFrame(
@@ -558,42 +772,44 @@ def main():
     # Tasks Page
     elif page == "📋 Tasks":
         st.header("📋 Running Tasks & Processes")
+        import pandas as pd
 
         # Bot Processes Section
         st.subheader("🤖 Bot Processes")
 
+        # One pass over the process table feeds both process sections
+        python_procs = python_processes()
+
+        bot_infos = [info for info in python_procs if runs_bot_script(info['cmdline'])]
+        bot_cpu = process_cpu_percent([info['pid'] for info in bot_infos])
+
         bot_processes = []
-        for proc in psutil.process_iter(['pid', 'name', 'cmdline', 'cpu_percent', 'memory_percent', 'create_time']):
-            try:
-                cmdline = proc.info['cmdline']
-                if cmdline and 'python' in str(cmdline).lower() and 'bot.py' in str(cmdline):
-                    uptime_seconds = time.time() - proc.info['create_time']
-                    uptime_minutes = uptime_seconds / 60
-
-                    bot_processes.append({
-                        'PID': proc.info['pid'],
-                        'Command': ' '.join(cmdline)[-50:],  # Last 50 chars
-                        'CPU %': f"{proc.info['cpu_percent']:.1f}%",
-                        'Memory %': f"{proc.info['memory_percent']:.1f}%",
-                        'Uptime': f"{int(uptime_minutes)} min",
-                        'Status': '🟢 Running'
-                    })
-            except (psutil.NoSuchProcess, psutil.AccessDenied):
-                continue
+        for info in bot_infos:
+            cmdline = info['cmdline']
+            uptime_seconds = time.time() - info['create_time']
+            uptime_minutes = uptime_seconds / 60
+
+            bot_processes.append({
+                'PID': info['pid'],
+                'Command': ' '.join(cmdline)[-50:],  # Last 50 chars
+                'CPU %': bot_cpu[info['pid']],
+                'Memory %': info['memory_percent'],
+                'Uptime': f"{int(uptime_minutes)} min",
+                'Status': '🟢 Running'
+            })
 
         if bot_processes:
+            # Numbers stay numeric; the percent sign is display formatting
             df_bot = pd.DataFrame(bot_processes)
-            st.dataframe(df_bot, use_container_width=True)
+            st.dataframe(df_bot, use_container_width=True, column_config=PERCENT_COLUMNS)
 
             col1, col2, col3 = st.columns(3)
             with col1:
-                st.metric("Active Bot Processes", len(bot_processes))
+                st.metric("Active Bot Processes", len(df_bot))
             with col2:
-                avg_cpu = sum([float(p['CPU %'].rstrip('%')) for p in bot_processes]) / len(bot_processes)
-                st.metric("Avg CPU Usage", f"{avg_cpu:.1f}%")
+                st.metric("Avg CPU Usage", f"{df_bot['CPU %'].mean():.1f}%")
             with col3:
-                avg_mem = sum([float(p['Memory %'].rstrip('%')) for p in bot_processes]) / len(bot_processes)
-                st.metric("Avg Memory Usage", f"{avg_mem:.1f}%")
+                st.metric("Avg Memory Usage", f"{df_bot['Memory %'].mean():.1f}%")
         else:
             st.warning("No bot processes running")
 
@@ -602,29 +818,20 @@ def main():
         # Recent Downloads Section
         st.subheader("📥 Recent Download Tasks")
 
-        conn = __import__('sqlite3').connect('analytics.db')
-        cursor = conn.cursor()
-        cursor.execute('''
-            SELECT timestamp, username, platform, content_type,
-                   CASE WHEN success = 1 THEN '✅ Success' ELSE '❌ Failed' END as status,
-                   ROUND(file_size / 1024.0 / 1024.0, 2) as size_mb
-            FROM downloads
-            ORDER BY timestamp DESC
-            LIMIT 15
-        ''')
-        recent_downloads = cursor.fetchall()
+        tasks = get_tasks_snapshot()
+        recent_downloads = tasks['recent_downloads']
 
         if recent_downloads:
             df_downloads = pd.DataFrame(
                 recent_downloads,
                 columns=['Time', 'User', 'Platform', 'Type', 'Status', 'Size (MB)']
             )
-            df_downloads['Time'] = pd.to_datetime(df_downloads['Time']).dt.strftime('%H:%M:%S')
-            st.dataframe(df_downloads, use_container_width=True, height=300)
+            # Download statistics (from the numeric columns, before labelling)
+            success_count = int(df_downloads['Status'].sum())
+            total_size = df_downloads['Size (MB)'].sum()
 
-            # Download statistics
-            success_count = len([d for d in recent_downloads if d[4] == '✅ Success'])
-            total_size = sum([d[5] for d in recent_downloads if d[5]])
+            df_downloads['Status'] = df_downloads['Status'].map({1: '✅ Success', 0: '❌ Failed'})
+            st.dataframe(df_downloads, use_container_width=True, height=300)
 
             col1, col2, col3 = st.columns(3)
             with col1:
@@ -641,30 +848,23 @@ def main():
         # Recent API Calls Section
         st.subheader("🎟️ Recent API Tasks")
 
-        cursor.execute('''
-            SELECT timestamp, username, feature,
-                   tokens_used, cost,
-                   CASE WHEN success = 1 THEN '✅ Success' ELSE '❌ Failed' END as status
-            FROM api_usage
-            ORDER BY timestamp DESC
-            LIMIT 15
-        ''')
-        recent_api = cursor.fetchall()
-        conn.close()
+        recent_api = tasks['recent_api_usage']
 
         if recent_api:
             df_api = pd.DataFrame(
                 recent_api,
                 columns=['Time', 'User', 'Feature', 'Tokens', 'Cost', 'Status']
             )
-            df_api['Time'] = pd.to_datetime(df_api['Time']).dt.strftime('%H:%M:%S')
-            df_api['Cost'] = df_api['Cost'].apply(lambda x: f"${x:.6f}")
-            st.dataframe(df_api, use_container_width=True, height=300)
-
-            # API statistics
-            success_count = len([a for a in recent_api if a[5] == '✅ Success'])
-            total_tokens = sum([a[3] for a in recent_api if a[3]])
-            total_cost = sum([a[4] for a in recent_api if a[4]])
+            # API statistics (from the numeric columns, before labelling)
+            success_count = int(df_api['Status'].sum())
+            total_tokens = int(df_api['Tokens'].sum())
+            total_cost = df_api['Cost'].sum()
+
+            df_api['Status'] = df_api['Status'].map({1: '✅ Success', 0: '❌ Failed'})
+            st.dataframe(
+                df_api, use_container_width=True, height=300,
+                column_config={'Cost': st.column_config.NumberColumn(format="$%.6f")}
+            )
 
             col1, col2, col3, col4 = st.columns(4)
             with col1:
@@ -684,23 +884,20 @@ def main():
         st.subheader("💻 All Python Processes")
 
         all_python = []
-        for proc in psutil.process_iter(['pid', 'name', 'cmdline', 'cpu_percent', 'memory_percent']):
-            try:
-                if 'python' in proc.info['name'].lower():
-                    cmdline = ' '.join(proc.info['cmdline']) if proc.info['cmdline'] else proc.info['name']
-                    all_python.append({
-                        'PID': proc.info['pid'],
-                        'Command': cmdline[-60:],  # Last 60 chars
-                        'CPU %': f"{proc.info['cpu_percent']:.1f}%",
-                        'Memory %': f"{proc.info['memory_percent']:.1f}%"
-                    })
-            except (psutil.NoSuchProcess, psutil.AccessDenied):
-                continue
+        for info in python_procs:
+            cmdline = ' '.join(info['cmdline']) if info['cmdline'] else info['name']
+            all_python.append({
+                'PID': info['pid'],
+                'Command': cmdline[-60:],  # Last 60 chars
+                'Memory %': info['memory_percent']
+            })
 
         if all_python:
             df_python = pd.DataFrame(all_python)
             with st.expander(f"View All Python Processes ({len(all_python)})"):
-                st.dataframe(df_python, use_container_width=True, height=400)
+                st.dataframe(df_python, use_container_width=True, height=400,
+                             column_config={'Memory %': PERCENT_COLUMNS['Memory %']})
+                st.caption("CPU usage is only sampled for bot processes")
 
         st.caption("💡 Refresh the page to update task information")
 
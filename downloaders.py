@@ -4,13 +4,160 @@ Handles downloading from Instagram, YouTube, TikTok, Facebook
 """
 
 import os
-import yt_dlp
-import instaloader
+import random
+import re
+import shutil
+import uuid
+import asyncio
 import logging
+import threading
 from pathlib import Path
+from typing import TYPE_CHECKING, List, Optional
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+if TYPE_CHECKING:
+    import yt_dlp
 
 logger = logging.getLogger(__name__)
 
+# Supported hosts (without a leading "www.") mapped to platform names
+PLATFORM_BY_HOST = {
+    'instagram.com': 'Instagram',
+    'youtube.com': 'YouTube',
+    'youtu.be': 'YouTube',
+    'tiktok.com': 'TikTok',
+    'vm.tiktok.com': 'TikTok',
+    'vt.tiktok.com': 'TikTok',
+    'facebook.com': 'Facebook',
+    'fb.watch': 'Facebook',
+}
+
+
+def detect_platform(url: str) -> Optional[str]:
+    """Return the platform name for a supported URL, or None."""
+    if '://' not in url:
+        url = '//' + url  # let urlsplit find the host in scheme-less links
+    host = (urlsplit(url).hostname or '').removeprefix('www.')
+    # Mobile hosts (m.youtube.com, m.facebook.com, ...) map to the main site
+    return PLATFORM_BY_HOST.get(host) or PLATFORM_BY_HOST.get(host.removeprefix('m.'))
+
+
+# Share/tracking query parameters that don't change what a link points to
+TRACKING_PARAMS = frozenset({'igsh', 'igshid', 'si', 'fbclid', 'feature', 'is_from_webapp', 'sender_device'})
+
+
+def canonical_url(url: str) -> str:
+    """
+    Normalise a link for cache lookups: lowercase host without "www.",
+    no fragment, no tracking parameters (utm_*, igsh, si, ...).
+    """
+    parts = urlsplit(url if '://' in url else 'https://' + url)
+    host = (parts.hostname or '').removeprefix('www.')
+    query = urlencode([
+        (key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True)
+        if key not in TRACKING_PARAMS and not key.startswith('utm_')
+    ])
+    return urlunsplit(('https', host, parts.path.rstrip('/'), query, ''))
+
+
+# File extensions sent to Telegram as video rather than photo
+VIDEO_EXTENSIONS = frozenset({'mp4', 'webm', 'mkv', 'mov', 'm4v'})
+
+# Telegram bots can't upload files larger than this
+MAX_FILE_BYTES = 50 * 1024 * 1024
+
+# Longest pause between yt-dlp retries, in seconds
+RETRY_SLEEP_MAX = 30
+
+# Errors worth retrying another way (rate limits, server errors, timeouts);
+# not 404s, private posts or removed videos. Statuses are matched as
+# "HTTP Error <code>" so digits in video ids and URLs don't count.
+RETRYABLE_ERROR = re.compile(r'HTTP Error (?:429|5\d\d)\b|timed out|timeout|connection reset', re.IGNORECASE)
+
+# Extra yt-dlp options tried in order when a download fails with one
+# of the errors above
+FALLBACK_OPTIONS = {
+    'YouTube': [
+        {'extractor_args': {'youtube': {'player_client': ['android']}}},
+        {'extractor_args': {'youtube': {'player_client': ['ios']}}},
+    ],
+}
+
+# Downloads allowed to run at once against one platform, so a batch of
+# links doesn't hammer a single CDN (bot.py caps the overall total)
+PLATFORM_CONCURRENCY = int(os.getenv('MAX_DOWNLOADS_PER_PLATFORM', '2'))
+
+# Socket timeout in seconds; grows after timeouts (slow links) up to
+# the maximum, and shrinks back after successful downloads
+SOCKET_TIMEOUT = 30
+SOCKET_TIMEOUT_MAX = 45
+
+
+def _retry_sleep(n: int) -> float:
+    """Randomized exponential backoff for yt-dlp retry number n (from 0)."""
+    return min(RETRY_SLEEP_MAX, random.uniform(0.5, 2 ** n))
+
+
+def _check_size(progress: dict):
+    """yt-dlp progress hook: abort a download once it can't fit MAX_FILE_BYTES."""
+    size = max(progress.get('total_bytes') or 0, progress.get('downloaded_bytes') or 0)
+    if progress['status'] == 'downloading' and size > MAX_FILE_BYTES:
+        from yt_dlp.utils import DownloadCancelled
+
+        # The partial file is removed with the download's directory
+        # (see _download_platform)
+        raise DownloadCancelled(f'File is larger than {MAX_FILE_BYTES // (1024 * 1024)} MB (Telegram limit)')
+
+
+# yt-dlp options shared by every platform
+YDL_BASE_OPTIONS = {
+    'format': 'best[filesize<50M]/best',  # Limit to 50MB for Telegram
+    'quiet': True,
+    'no_warnings': True,
+    'noprogress': True,
+    # "best" falls back to formats without a known size, so the size
+    # limit is also enforced while downloading
+    'progress_hooks': [_check_size],
+    # Fetch segmented (DASH/HLS) formats 4 fragments at a time
+    'concurrent_fragment_downloads': 4,
+    # Retries back off (randomly, up to RETRY_SLEEP_MAX) instead
+    # of hitting a rate-limited site again straight away
+    'retries': 6,
+    'fragment_retries': 6,
+    'extractor_retries': 4,
+    'retry_sleep_functions': {
+        'http': _retry_sleep,
+        'fragment': _retry_sleep,
+        'file_access': _retry_sleep,
+        'extractor': _retry_sleep,
+    },
+}
+
+# Extra yt-dlp options per platform
+YDL_PLATFORM_OPTIONS = {
+    'Instagram': {
+        # Add headers to avoid blocking
+        'http_headers': {
+            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
+            'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
+            'Accept-Language': 'en-us,en;q=0.5',
+            'Sec-Fetch-Mode': 'navigate',
+        },
+    },
+    'YouTube': {},
+    'TikTok': {},
+    'Facebook': {},
+}
+
+# Per platform: info fields tried in order for the caption, and whether
+# a post may be an image rather than a video
+PLATFORM_RESULT_FIELDS = {
+    'Instagram': (('description', 'title'), True),
+    'YouTube': (('title',), False),
+    'TikTok': (('description',), False),
+    'Facebook': (('title',), False),
+}
+
 
 class ContentDownloader:
     """Download content from various social media platforms."""
@@ -19,205 +166,185 @@ class ContentDownloader:
         self.download_dir = Path("downloads")
         self.download_dir.mkdir(exist_ok=True)
 
-        # Initialize instaloader
-        self.insta_loader = instaloader.Instaloader(
-            download_videos=True,
-            download_video_thumbnails=False,
-            download_geotags=False,
-            download_comments=False,
-            save_metadata=False,
-            compress_json=False,
-        )
-
-    async def download(self, url: str) -> dict:
+        # yt-dlp options per platform; each download gets its own
+        # directory under download_dir (see _download_platform)
+        self._ydl_opts = {
+            platform: {
+                **YDL_BASE_OPTIONS,
+                **platform_opts,
+                'outtmpl': f'{platform.lower()}_%(id)s.%(ext)s',
+            }
+            for platform, platform_opts in YDL_PLATFORM_OPTIONS.items()
+        }
+
+        # Per-thread YoutubeDL instances (see _ydl)
+        self._local = threading.local()
+
+        # Current socket timeout per platform
+        self._timeouts = dict.fromkeys(self._ydl_opts, SOCKET_TIMEOUT)
+
+        # Download slots per platform (see PLATFORM_CONCURRENCY)
+        self._platform_slots = {
+            platform: asyncio.Semaphore(PLATFORM_CONCURRENCY) for platform in self._ydl_opts
+        }
+
+    async def download(self, url: str, platform: Optional[str] = None) -> dict:
         """
         Download content from URL.
 
         Args:
             url: URL to download from
+            platform: Platform name if the caller already detected it
 
         Returns:
             dict with success, type, file_path, platform, error, caption
         """
         try:
-            # Detect platform
-            if 'instagram.com' in url:
-                return await self._download_instagram(url)
-            elif 'youtube.com' in url or 'youtu.be' in url:
-                return await self._download_youtube(url)
-            elif 'tiktok.com' in url:
-                return await self._download_tiktok(url)
-            elif 'facebook.com' in url or 'fb.watch' in url:
-                return await self._download_facebook(url)
-            else:
+            platform = platform or detect_platform(url)
+            if platform not in self._ydl_opts:
                 return {
                     'success': False,
                     'error': 'Unsupported platform'
                 }
 
+            async with self._platform_slots[platform]:
+                return await self._download_platform(url, platform)
+
         except Exception as e:
-            logger.error(f"Download error: {e}")
+            logger.error("Download error: %s", e)
             return {
                 'success': False,
                 'error': str(e)
             }
 
-    async def _download_instagram(self, url: str) -> dict:
-        """Download from Instagram using yt-dlp (more reliable)."""
-        try:
-            output_template = str(self.download_dir / 'instagram_%(id)s.%(ext)s')
-
-            # yt-dlp options with better Instagram support and timeout handling
-            ydl_opts = {
-                'outtmpl': output_template,
-                'format': 'best[filesize<50M]/best',
-                'quiet': True,
-                'no_warnings': True,
-                # Timeout settings
-                'socket_timeout': 30,  # 30 seconds socket timeout
-                'retries': 3,  # Retry 3 times
-                'fragment_retries': 3,
-                # Add headers to avoid blocking
-                'http_headers': {
-                    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
-                    'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
-                    'Accept-Language': 'en-us,en;q=0.5',
-                    'Sec-Fetch-Mode': 'navigate',
-                }
-            }
-
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                # Extract info first
-                info = ydl.extract_info(url, download=True)
-                filename = ydl.prepare_filename(info)
+    async def download_many(self, urls: List[str]) -> List[dict]:
+        """
+        Download several URLs, returning one result dict per URL (in order).
 
-                # Determine type (video or image)
-                file_ext = filename.split('.')[-1].lower()
-                media_type = 'video' if file_ext in ['mp4', 'webm', 'mkv'] else 'image'
+        Different platforms download concurrently; links to the same
+        platform share its PLATFORM_CONCURRENCY slots, so a long batch
+        is spread over a few worker threads that keep a warm YoutubeDL.
+        """
+        return list(await asyncio.gather(*(self.download(url) for url in urls)))
 
-                return {
-                    'success': True,
-                    'type': media_type,
-                    'file_path': filename,
-                    'platform': 'Instagram',
-                    'caption': info.get('description', '') or info.get('title', '')
-                }
+    def discard(self, file_path: str):
+        """Delete a downloaded file along with its per-download directory."""
+        request_dir = Path(file_path).parent
+        if request_dir.parent == self.download_dir:
+            shutil.rmtree(request_dir, ignore_errors=True)
 
-        except Exception as e:
-            logger.error(f"Instagram download error: {e}")
-            error_msg = str(e)
+    def _ydl(self, platform: str) -> 'yt_dlp.YoutubeDL':
+        """
+        This thread's YoutubeDL for a platform, created on first use.
 
-            # User-friendly error messages
-            if 'timed out' in error_msg.lower() or 'timeout' in error_msg.lower():
-                error_msg = 'Download timed out. The video/image might be too large or network is slow. Please try again.'
-            elif '401' in error_msg or '403' in error_msg:
-                error_msg = 'Access denied. The post might be private or restricted.'
-            elif '404' in error_msg:
-                error_msg = 'Post not found. Check if the link is correct.'
+        Instances are kept so connections and extractor state are reused
+        between downloads; YoutubeDL isn't thread-safe, so each worker
+        thread gets its own.
+        """
+        # yt-dlp is imported on first download; it is slow to import and
+        # not needed to start the bot
+        import yt_dlp
+
+        instances = self._local.__dict__.setdefault('ydl', {})
+        ydl = instances.get(platform)
+        timeout = self._timeouts[platform]
+
+        # The timeout is fixed when the instance sets up its HTTP handlers,
+        # so a changed timeout means a new instance
+        if ydl is None or ydl.params['socket_timeout'] != timeout:
+            if ydl is not None:
+                ydl.close()
+            ydl = instances[platform] = yt_dlp.YoutubeDL(
+                {**self._ydl_opts[platform], 'socket_timeout': timeout}
+            )
+        return ydl
+
+    def _extract(self, platform: str, url: str, dest: Path) -> tuple:
+        """
+        Download with yt-dlp into `dest` and return (info, filename).
 
-            return {
-                'success': False,
-                'error': f'Instagram error: {error_msg}'
-            }
+        Blocks for the whole download, so callers run it in a worker
+        thread (asyncio.to_thread) to keep the event loop free.
+        Network-type failures are retried with the platform's
+        FALLBACK_OPTIONS, if any.
+        """
+        ydl = self._ydl(platform)
+        timeout = self._timeouts[platform]
+        # Read by yt-dlp on every download, so the cached instance can
+        # be pointed at this request's directory
+        ydl.params['paths'] = {'home': str(dest)}
 
-    async def _download_youtube(self, url: str) -> dict:
-        """Download from YouTube."""
         try:
-            output_template = str(self.download_dir / 'youtube_%(id)s.%(ext)s')
-
-            ydl_opts = {
-                'outtmpl': output_template,
-                'format': 'best[filesize<50M]/best',  # Limit to 50MB for Telegram
-                'quiet': True,
-                'no_warnings': True,
-                'socket_timeout': 30,
-                'retries': 3,
-                'fragment_retries': 3,
-            }
-
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                info = ydl.extract_info(url, download=True)
-                filename = ydl.prepare_filename(info)
-
-                return {
-                    'success': True,
-                    'type': 'video',
-                    'file_path': filename,
-                    'platform': 'YouTube',
-                    'caption': info.get('title', '')
-                }
-
+            info = ydl.extract_info(url, download=True)
         except Exception as e:
-            logger.error(f"YouTube download error: {e}")
-            return {
-                'success': False,
-                'error': f'YouTube error: {str(e)}'
-            }
+            error_msg = str(e).lower()
+            if 'timed out' in error_msg:
+                self._timeouts[platform] = min(SOCKET_TIMEOUT_MAX, int(timeout * 1.5))
+            if not RETRYABLE_ERROR.search(error_msg):
+                raise
+            return self._extract_fallback(platform, url, dest, e)
+
+        self._timeouts[platform] = max(SOCKET_TIMEOUT, int(timeout * 0.9))
+        return info, ydl.prepare_filename(info)
+
+    def _extract_fallback(self, platform: str, url: str, dest: Path, error: Exception) -> tuple:
+        """Try each fallback option set in turn; re-raise `error` if all fail."""
+        import yt_dlp
+
+        for fallback_opts in FALLBACK_OPTIONS.get(platform, ()):
+            opts = {**self._ydl_opts[platform], 'socket_timeout': self._timeouts[platform],
+                    'paths': {'home': str(dest)}, **fallback_opts}
+            try:
+                with yt_dlp.YoutubeDL(opts) as ydl:
+                    info = ydl.extract_info(url, download=True)
+                    logger.info("%s download succeeded with fallback %s", platform, fallback_opts)
+                    return info, ydl.prepare_filename(info)
+            except Exception as e:
+                logger.warning("%s fallback %s failed: %s", platform, fallback_opts, e)
+        raise error
+
+    async def _download_platform(self, url: str, platform: str) -> dict:
+        """
+        Download from any supported platform using yt-dlp.
 
-    async def _download_tiktok(self, url: str) -> dict:
-        """Download from TikTok."""
+        Every call writes to a fresh directory, so concurrent requests for
+        the same post never share (or delete) each other's files; the
+        caller removes it with discard() once the file has been sent.
+        """
+        request_dir = self.download_dir / uuid.uuid4().hex
         try:
-            output_template = str(self.download_dir / 'tiktok_%(id)s.%(ext)s')
-
-            ydl_opts = {
-                'outtmpl': output_template,
-                'format': 'best[filesize<50M]/best',
-                'quiet': True,
-                'no_warnings': True,
-                'socket_timeout': 30,
-                'retries': 3,
-                'fragment_retries': 3,
-            }
+            info, filename = await asyncio.to_thread(self._extract, platform, url, request_dir)
 
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                info = ydl.extract_info(url, download=True)
-                filename = ydl.prepare_filename(info)
+            caption_keys, mixed_media = PLATFORM_RESULT_FIELDS[platform]
+            media_type = 'video'
+            if mixed_media:
+                # Determine type (video or image); yt-dlp reports the extension
+                ext = (info.get('ext') or os.path.splitext(filename)[1].lstrip('.')).lower()
+                media_type = 'video' if ext in VIDEO_EXTENSIONS else 'image'
 
-                return {
-                    'success': True,
-                    'type': 'video',
-                    'file_path': filename,
-                    'platform': 'TikTok',
-                    'caption': info.get('description', '')
-                }
-
-        except Exception as e:
-            logger.error(f"TikTok download error: {e}")
             return {
-                'success': False,
-                'error': f'TikTok error: {str(e)}'
-            }
-
-    async def _download_facebook(self, url: str) -> dict:
-        """Download from Facebook."""
-        try:
-            output_template = str(self.download_dir / 'facebook_%(id)s.%(ext)s')
-
-            ydl_opts = {
-                'outtmpl': output_template,
-                'format': 'best[filesize<50M]/best',
-                'quiet': True,
-                'no_warnings': True,
-                'socket_timeout': 30,
-                'retries': 3,
-                'fragment_retries': 3,
+                'success': True,
+                'type': media_type,
+                'file_path': filename,
+                'platform': platform,
+                'caption': next((info[key] for key in caption_keys if info.get(key)), '')
             }
 
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                info = ydl.extract_info(url, download=True)
-                filename = ydl.prepare_filename(info)
+        except Exception as e:
+            logger.error("%s download error: %s", platform, e)
+            # Drop partial (.part) files along with the directory
+            await asyncio.to_thread(shutil.rmtree, request_dir, ignore_errors=True)
+            error_msg = str(e)
 
-                return {
-                    'success': True,
-                    'type': 'video',
-                    'file_path': filename,
-                    'platform': 'Facebook',
-                    'caption': info.get('title', '')
-                }
+            # User-friendly error messages
+            if 'timed out' in error_msg.lower() or 'timeout' in error_msg.lower():
+                error_msg = 'Download timed out. The video/image might be too large or network is slow. Please try again.'
+            elif '401' in error_msg or '403' in error_msg:
+                error_msg = 'Access denied. The post might be private or restricted.'
+            elif '404' in error_msg:
+                error_msg = 'Post not found. Check if the link is correct.'
 
-        except Exception as e:
-            logger.error(f"Facebook download error: {e}")
             return {
                 'success': False,
-                'error': f'Facebook error: {str(e)}'
+                'error': f'{platform} error: {error_msg}'
             }
@@ -0,0 +1,165 @@
+"""
+Response Cache Module
+LRU cache for AI-generated captions, hashtags and image analysis (optionally
+backed by SQLite so repeats survive restarts), and for media already
+uploaded to Telegram
+"""
+
+import asyncio
+import hashlib
+import json
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Optional
+
+# Filler words left out of generated hashtags
+STOPWORDS = frozenset(
+    "a an and at by for from in into of on or the to with my our your "
+    "this that these those is are was be".split()
+)
+
+# Words ignored in topic cache keys; only articles, since prepositions
+# and word order can change what a topic means ("gifts for mom" vs
+# "gifts from mom", "dog bites man" vs "man bites dog")
+ARTICLES = frozenset({'a', 'an', 'the'})
+
+
+class ResponseCache:
+    """
+    LRU cache with a per-entry TTL for AI responses.
+
+    With db_path set, entries are also written to SQLite and kept for
+    disk_ttl seconds; memory misses fall back to the database.
+    Values must be JSON-serialisable in that case. The database is
+    opened on first use and only touched from worker threads, so
+    get/set never block the event loop.
+    """
+
+    # Seconds between sweeps of expired rows from the database
+    SWEEP_INTERVAL = 86400
+
+    def __init__(self, max_entries: int = 10000, ttl: float = 3600,
+                 db_path: Optional[str] = None, disk_ttl: float = 7 * 86400):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.disk_ttl = disk_ttl
+        self._entries = OrderedDict()
+
+        self.db_path = db_path
+        self._db = None
+        self._db_lock = threading.Lock()
+
+    @staticmethod
+    def topic_key(feature: str, topic: str) -> str:
+        """
+        Build a cache key for a text topic.
+
+        Case, punctuation, spacing and articles are ignored, so
+        "Sunset  beach!" and "the sunset beach" share one entry.
+        """
+        words = re.findall(r'\w+', topic.lower())
+        words = [w for w in words if w not in ARTICLES] or words
+        return hashlib.sha256(f"{feature}:{' '.join(words)}".encode()).hexdigest()
+
+    @staticmethod
+    def file_key(feature: str, file_unique_id: str) -> str:
+        """Build a cache key for a Telegram file (same file -> same unique id)."""
+        return hashlib.sha256(f"{feature}:file:{file_unique_id}".encode()).hexdigest()
+
+    async def get(self, key: str) -> Optional[Any]:
+        """Return the cached value, or None if missing or expired."""
+        entry = self._entries.get(key)
+        if entry is not None:
+            expires_at, value = entry
+            if time.monotonic() < expires_at:
+                self._entries.move_to_end(key)
+                return value
+            del self._entries[key]
+
+        if self.db_path is None:
+            return None
+
+        value = await asyncio.to_thread(self._load, key)
+        if value is not None:
+            self._remember(key, value)
+        return value
+
+    async def set(self, key: str, value: Any):
+        """Cache a value, evicting the least recently used entry when full."""
+        self._remember(key, value)
+        if self.db_path is not None:
+            await asyncio.to_thread(self._store, key, json.dumps(value))
+
+    def clear(self):
+        """Drop every cached value."""
+        self._entries.clear()
+        if self.db_path is not None:
+            with self._db_lock:
+                self._connection().execute('DELETE FROM responses')
+
+    def _remember(self, key: str, value: Any):
+        """Keep a value in memory for ttl seconds."""
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _connection(self) -> sqlite3.Connection:
+        """Open the database on first use (call with _db_lock held)."""
+        if self._db is None:
+            self._db = sqlite3.connect(self.db_path, check_same_thread=False, isolation_level=None)
+            self._db.executescript('''
+                PRAGMA journal_mode=WAL;
+                PRAGMA synchronous=NORMAL;
+                CREATE TABLE IF NOT EXISTS responses (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL,
+                    expires_at REAL NOT NULL
+                );
+            ''')
+            self._sweep()
+        return self._db
+
+    def _load(self, key: str) -> Optional[Any]:
+        """Look a key up in the database (runs in a worker thread)."""
+        with self._db_lock:
+            row = self._connection().execute(
+                'SELECT value FROM responses WHERE key = ? AND expires_at > ?',
+                (key, time.time())
+            ).fetchone()
+        return None if row is None else json.loads(row[0])
+
+    def _store(self, key: str, value: str):
+        """Write a JSON-encoded value to the database (runs in a worker thread)."""
+        with self._db_lock:
+            db = self._connection()
+            now = time.time()
+            db.execute(
+                'INSERT OR REPLACE INTO responses (key, value, expires_at) VALUES (?, ?, ?)',
+                (key, value, now + self.disk_ttl)
+            )
+            if now >= self._next_sweep:
+                self._sweep()
+
+    def _sweep(self):
+        """Delete expired rows from the database."""
+        now = time.time()
+        self._db.execute('DELETE FROM responses WHERE expires_at <= ?', (now,))
+        self._next_sweep = now + self.SWEEP_INTERVAL
+
+
+def is_error_response(text: str) -> bool:
+    """CaptionGenerator reports failures as text starting with a warning sign."""
+    return text.startswith("⚠️")
+
+
+# Global cache instances
+response_cache = ResponseCache(db_path="response_cache.db")
+
+# Recently downloaded links (canonical URL) -> Telegram file_id of the
+# uploaded media; file_ids stay valid, so repeats skip yt-dlp for hours
+media_cache = ResponseCache(max_entries=500, ttl=600, db_path="media_cache.db", disk_ttl=6 * 3600)
@@ -5,6 +5,7 @@ Run this to test if everything is configured correctly
 
 import os
 import sys
+from importlib.util import find_spec
 from dotenv import load_dotenv
 
 print("🔍 Checking your bot setup...\n")
@@ -47,16 +48,24 @@ print("\n3. Checking required packages...")
 required_packages = [
     ('telegram', 'python-telegram-bot'),
     ('yt_dlp', 'yt-dlp'),
-    ('instaloader', 'instaloader'),
     ('google.generativeai', 'google-generativeai'),
     ('dotenv', 'python-dotenv'),
 ]
 
-for module_name, package_name in required_packages:
+
+def is_installed(module_name):
+    """Locate a module without importing (running) it."""
     try:
-        __import__(module_name)
-        print(f"   ✅ {package_name}")
+        return find_spec(module_name) is not None
     except ImportError:
+        # Dotted names raise if the parent package is missing
+        return False
+
+
+for module_name, package_name in required_packages:
+    if is_installed(module_name):
+        print(f"   ✅ {package_name}")
+    else:
         errors.append(f"Package '{package_name}' not installed")
         print(f"   ❌ {package_name} - run: pip install {package_name}")
 